@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""\
+Simulate a high-latency (network) filesystem, adding a fixed delay to
+each directory listing, stat and open, and compare the scan times of the
+serial, threaded (--jobs) and asyncio (--async-ops) scanners; the
+results of all the scans must be the same.
+"""
+
+__author__ = 'Simone Campagna'
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import builtins
+import tempfile
+
+from memory_usage import make_synthetic_tree
+
+class _SlowDirEntry(object):
+    __slots__ = ('_entry', '_latency')
+    def __init__(self, entry, latency):
+        self._entry = entry
+        self._latency = latency
+
+    @property
+    def name(self):
+        return self._entry.name
+
+    @property
+    def path(self):
+        return self._entry.path
+
+    def is_dir(self, *, follow_symlinks=True):
+        return self._entry.is_dir(follow_symlinks=follow_symlinks)
+
+    def stat(self, *, follow_symlinks=True):
+        time.sleep(self._latency)
+        return self._entry.stat(follow_symlinks=follow_symlinks)
+
+class _SlowScandir(object):
+    def __init__(self, dirpath, latency):
+        time.sleep(latency)
+        self._scandir = _scandir(dirpath)
+        self._latency = latency
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._scandir.close()
+
+    def __iter__(self):
+        for entry in self._scandir:
+            yield _SlowDirEntry(entry, self._latency)
+
+_scandir = os.scandir
+_stat = os.stat
+_open = builtins.open
+
+def inject_latency(latency):
+    """inject_latency(latency)
+       Make os.scandir, DirEntry.stat, os.stat and open wait 'latency'
+       seconds before each call (the GIL is released while waiting, as
+       while waiting for a network filesystem).
+    """
+    def slow_stat(*args, **kwargs):
+        time.sleep(latency)
+        return _stat(*args, **kwargs)
+
+    def slow_open(*args, **kwargs):
+        time.sleep(latency)
+        return _open(*args, **kwargs)
+
+    os.scandir = lambda dirpath: _SlowScandir(dirpath, latency)
+    os.stat = slow_stat
+    builtins.open = slow_open
+
+def remove_latency():
+    """remove_latency()
+       Restore the functions patched by inject_latency.
+    """
+    os.scandir = _scandir
+    os.stat = _stat
+    builtins.open = _open
+
+def main():
+    top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_config_file = os.path.join(top_dir, 'etc', 'statcode', 'statcode.ini')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("project_dirs", nargs='*', help="project directories (default: a synthetic tree)")
+    parser.add_argument("--config", "-c", default=default_config_file, help="config file")
+    parser.add_argument("--lib", default=os.path.join(top_dir, 'lib', 'python'), help="statcode library directory")
+    parser.add_argument("--num-files", "-n", type=int, default=2000, help="number of files of the synthetic tree")
+    parser.add_argument("--files-per-dir", type=int, default=20, help="files per directory of the synthetic tree")
+    parser.add_argument("--dirs-per-dir", type=int, default=3, help="subdirectories per directory of the synthetic tree")
+    parser.add_argument("--latency", "-l", type=float, default=0.002, help="seconds added to each filesystem operation [%(default)s]")
+    parser.add_argument("--concurrency", "-j", type=int, default=32, help="threads (--jobs) and operations in flight (--async-ops) [%(default)s]")
+    parser.add_argument("--serial", action="store_true", default=False, help="run the serial scan too (slow)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.lib)
+    from statcode.statcode_config import StatCodeConfig
+    from statcode.project import Project, ProjectConfiguration
+
+    configuration = ProjectConfiguration(StatCodeConfig.fromfiles(args.config))
+    modes = []
+    if args.serial:
+        modes.append(('serial', {}))
+    modes.append(('jobs={}'.format(args.concurrency), {'jobs': args.concurrency}))
+    modes.append(('async_ops={}'.format(args.concurrency), {'async_ops': args.concurrency}))
+
+    tmpdir = None
+    project_dirs = args.project_dirs
+    if not project_dirs:
+        tmpdir = tempfile.mkdtemp(prefix='statcode-latency-')
+        make_synthetic_tree(tmpdir, args.num_files, args.files_per_dir, args.dirs_per_dir)
+        project_dirs = [tmpdir]
+    try:
+        for project_dir in project_dirs:
+            project_dir = os.path.abspath(project_dir)
+            print("{}: latency {:.1f} ms".format(project_dir, args.latency * 1000))
+            results = []
+            for label, project_args in modes:
+                inject_latency(args.latency)
+                try:
+                    t0 = time.time()
+                    project = Project(configuration=configuration, project_dir=project_dir, progress_bar_level=0, **project_args)
+                    elapsed = time.time() - t0
+                finally:
+                    remove_latency()
+                result = (sorted((filetype, stats.files, stats.lines, stats.bytes) for filetype, stats in project.tree_filetype_stats.items()),
+                          sorted(project.file_table.filepaths()))
+                results.append(result)
+                print("  {:16s} {} files, {:8.2f} s".format(label, project.tree_stats.files, elapsed))
+            if any(result != results[0] for result in results[1:]):
+                print("  ERR: the results are different")
+                sys.exit(1)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""\
+Compare the keyword scoring engines on some files: the old per-keyword
+regular expression loop, the token scanner ('regex' engine) and the
+Aho-Corasick automaton ('aho-corasick' engine).
+"""
+
+__author__ = 'Simone Campagna'
+
+import os
+import re
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib', 'python'))
+
+from statcode.statcode_config import StatCodeConfig
+from statcode.filetype_classifier import FileTypeClassifier
+
+def per_keyword_regex_scan(classifier, keywords):
+    keyword_res = dict((classifier._keyword_index[keyword], re.compile(classifier._keyword_patterns[keyword])) for keyword in keywords)
+    def scan(line, keyword_counts):
+        for index, keyword_re in keyword_res.items():
+            score = 0
+            for m in keyword_re.finditer(line):
+                score += 1
+            if score:
+                keyword_counts[index] += score
+    return scan
+
+def make_classifier(statcode_config, keyword_engine):
+    parameters = dict(statcode_config['parameters'])
+    parameters['keyword_engine'] = keyword_engine
+    return FileTypeClassifier(statcode_config.get_filetype_config(), statcode_config.get_qualifier_config(), parameters)
+
+def run(scan, num_keywords, lines, repeat):
+    best = None
+    for count in range(repeat):
+        keyword_counts = [0] * num_keywords
+        t0 = time.time()
+        for line in lines:
+            scan(line, keyword_counts)
+        elapsed = time.time() - t0
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, keyword_counts
+
+def main():
+    default_config_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'etc', 'statcode', 'statcode.ini')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs='+', help="files to scan")
+    parser.add_argument("--config", "-c", default=default_config_file, help="config file")
+    parser.add_argument("--filetypes", "-f", nargs='+', default=['c', 'c++', 'Objective-C', 'Objective-C++'], help="candidate filetypes")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="number of repetitions")
+    args = parser.parse_args()
+
+    statcode_config = StatCodeConfig.fromfiles(args.config)
+    lines = []
+    for filename in args.files:
+        with open(filename, 'r', errors='replace') as filehandle:
+            lines.extend(filehandle)
+
+    regex_classifier = make_classifier(statcode_config, FileTypeClassifier.KEYWORD_ENGINE_REGEX)
+    aho_corasick_classifier = make_classifier(statcode_config, FileTypeClassifier.KEYWORD_ENGINE_AHO_CORASICK)
+    keywords = set()
+    for filetype in args.filetypes:
+        keywords.update(regex_classifier._filetype_keywords[filetype])
+
+    engines = [
+        ('per-keyword regex', per_keyword_regex_scan(regex_classifier, keywords)),
+        ('token scanner', regex_classifier._get_keyword_scanner(args.filetypes, keywords).scan),
+        ('aho-corasick', aho_corasick_classifier._get_keyword_scanner(args.filetypes, keywords).scan),
+    ]
+    print("{} lines, {} keywords".format(len(lines), len(keywords)))
+    reference_counts = None
+    for name, scan in engines:
+        elapsed, keyword_counts = run(scan, len(regex_classifier._keyword_index), lines, args.repeat)
+        if reference_counts is None:
+            reference_counts = keyword_counts
+            check = ''
+        elif keyword_counts == reference_counts:
+            check = 'same scores'
+        else:
+            check = 'DIFFERENT scores'
+        print("{:20s} {:8.3f} s {:10.0f} lines/s {}".format(name, elapsed, len(lines) / elapsed, check))
+
+if __name__ == "__main__":
+    main()
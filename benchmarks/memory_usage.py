@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""\
+Measure the memory retained by a scanned project, in bytes per file,
+with tracemalloc. By default a synthetic tree is scanned; --lib allows
+to compare with another version of the library.
+"""
+
+__author__ = 'Simone Campagna'
+
+import os
+import sys
+import gc
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+def make_synthetic_tree(rootdir, num_files, files_per_dir, dirs_per_dir, dir_name_length=0):
+    """make_synthetic_tree(rootdir, num_files, files_per_dir, dirs_per_dir, dir_name_length=0)
+       Create a tree with 'num_files' small source files; directory names
+       are padded to 'dir_name_length' characters.
+    """
+    contents = {
+        '.c': '#include <stdio.h>\nint main(void) {\n    return 0;\n}\n',
+        '.h': '#ifndef X_H\n#define X_H\nextern int x;\n#endif\n',
+        '.py': 'import os\n\ndef f():\n    return os.getcwd()\n',
+        '.txt': 'some text\n',
+    }
+    extensions = sorted(contents)
+    dirpaths = [rootdir]
+    num_created = 0
+    index = 0
+    while num_created < num_files:
+        dirpath = dirpaths[index]
+        index += 1
+        for dir_index in range(dirs_per_dir):
+            subdirpath = os.path.join(dirpath, 'directory_{}'.format(dir_index).ljust(dir_name_length, '_'))
+            os.mkdir(subdirpath)
+            dirpaths.append(subdirpath)
+        for file_index in range(min(files_per_dir, num_files - num_created)):
+            extension = extensions[file_index % len(extensions)]
+            with open(os.path.join(dirpath, 'source_file_{}{}'.format(file_index, extension)), 'w') as f_out:
+                f_out.write(contents[extension])
+            num_created += 1
+    return len(dirpaths)
+
+def main():
+    top_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    default_config_file = os.path.join(top_dir, 'etc', 'statcode', 'statcode.ini')
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("project_dirs", nargs='*', help="project directories (default: a synthetic tree)")
+    parser.add_argument("--config", "-c", default=default_config_file, help="config file")
+    parser.add_argument("--lib", default=os.path.join(top_dir, 'lib', 'python'), help="statcode library directory")
+    parser.add_argument("--num-files", "-n", type=int, default=20000, help="number of files of the synthetic tree")
+    parser.add_argument("--files-per-dir", type=int, default=20, help="files per directory of the synthetic tree")
+    parser.add_argument("--dirs-per-dir", type=int, default=3, help="subdirectories per directory of the synthetic tree")
+    parser.add_argument("--dir-name-length", type=int, default=0, help="directory name length of the synthetic tree (deep trees have long paths)")
+    parser.add_argument("--aggregate-only", action="store_true", default=False, help="scan in aggregate-only mode")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="scan with threads")
+    parser.add_argument("--async-ops", type=int, default=None, help="scan with asyncio")
+    parser.add_argument("--pipeline", type=lambda x: tuple(int(w) for w in x.split(',')), default=None, help="scan with a pipeline (W,N,C,L workers)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, args.lib)
+    from statcode.statcode_config import StatCodeConfig
+    from statcode.project import Project, ProjectConfiguration
+
+    configuration = ProjectConfiguration(StatCodeConfig.fromfiles(args.config))
+    tmpdir = None
+    project_dirs = args.project_dirs
+    if not project_dirs:
+        tmpdir = tempfile.mkdtemp(prefix='statcode-memory-')
+        make_synthetic_tree(tmpdir, args.num_files, args.files_per_dir, args.dirs_per_dir, args.dir_name_length)
+        project_dirs = [tmpdir]
+    try:
+        for project_dir in project_dirs:
+            gc.collect()
+            tracemalloc.start()
+            t0 = time.time()
+            project_args = {}
+            if args.aggregate_only:
+                project_args['aggregate_only'] = True
+            if args.jobs is not None:
+                project_args['jobs'] = args.jobs
+            if args.async_ops is not None:
+                project_args['async_ops'] = args.async_ops
+            if args.pipeline is not None:
+                project_args['pipeline_workers'] = args.pipeline
+            project = Project(configuration=configuration, project_dir=os.path.abspath(project_dir), progress_bar_level=0, **project_args)
+            elapsed = time.time() - t0
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            num_files = project.tree_stats.files
+            print("{}: {} files, {} dirs, {:.2f} s".format(project_dir, num_files, project.tree_stats.dirs, elapsed))
+            print("  retained: {:12d} bytes, {:8.1f} bytes/file".format(current, current / max(num_files, 1)))
+            print("  peak:     {:12d} bytes, {:8.1f} bytes/file".format(peak, peak / max(num_files, 1)))
+            del project
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import collections
+
+class AhoCorasick(object):
+    """AhoCorasick(keywords)
+       A pure python Aho-Corasick automaton: find all the occurrences of
+       all the keywords in a text with a single scan of the text.
+    """
+    def __init__(self, keywords):
+        self.keywords = frozenset(keywords)
+        # trie
+        goto = [{}]
+        output = [()]
+        for keyword in sorted(self.keywords):
+            state = 0
+            for char in keyword:
+                next_state = goto[state].get(char, None)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    output.append(())
+                    goto[state][char] = next_state
+                state = next_state
+            output[state] += (keyword, )
+
+        # failure links, breadth first
+        fail = [0] * len(goto)
+        queue = collections.deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fail_state = fail[state]
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail_state = goto[fail_state].get(char, 0)
+                if fail_state == next_state:
+                    fail_state = 0
+                fail[next_state] = fail_state
+                output[next_state] += output[fail_state]
+
+        self._goto = goto
+        self._fail = fail
+        self._output = output
+
+    def iter_matches(self, text):
+        """iter_matches(text) -> iterator over (end, keyword)
+           'end' is the index of the last character of the match.
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for end, char in enumerate(text):
+            next_state = goto[state].get(char, None)
+            while next_state is None:
+                if state == 0:
+                    next_state = 0
+                    break
+                state = fail[state]
+                next_state = goto[state].get(char, None)
+            state = next_state
+            for keyword in output[state]:
+                yield end, keyword
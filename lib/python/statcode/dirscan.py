@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import stat
+import collections
+
+from . import patternutils
+from .file_reader import NO_IO_LIMIT
+
+FileEntry = collections.namedtuple('FileEntry', ('filepath', 'filename', 'stat_result'))
+
+def scan_dir(dirpath, exclude_dir_names, exclude_dir_matchers, exclude_file_names, exclude_file_matchers, io_limit=NO_IO_LIMIT):
+    """scan_dir(...) -> (dirpaths, file_entries)
+       List 'dirpath' with os.scandir; directories (symlinks are followed)
+       are returned as paths, files as FileEntry items carrying the stat
+       result, or None if the entry cannot be stat'ed (for instance a
+       broken link). The listing, and each stat, are done holding
+       'io_limit' (see FileReader).
+    """
+    dirpaths = []
+    file_dir_entries = []
+    try:
+        with io_limit, os.scandir(dirpath) as entries:
+            for entry in entries:
+                name = entry.name
+                if entry.is_dir():
+                    if not patternutils.match_names_or_matchers(exclude_dir_names, exclude_dir_matchers, name):
+                        dirpaths.append(entry.path)
+                else:
+                    if not patternutils.match_names_or_matchers(exclude_file_names, exclude_file_matchers, name):
+                        file_dir_entries.append(entry)
+    except OSError as e:
+        pass
+    file_entries = []
+    for entry in file_dir_entries:
+        try:
+            with io_limit:
+                stat_result = entry.stat()
+        except OSError:
+            stat_result = None
+        file_entries.append(FileEntry(filepath=entry.path, filename=entry.name, stat_result=stat_result))
+    return dirpaths, file_entries
+
+def stat_dir(dirpath, dirnames, filenames, io_limit=NO_IO_LIMIT):
+    """stat_dir(dirpath, dirnames, filenames, io_limit=NO_IO_LIMIT) -> (dirpaths, file_entries) or None
+       Rebuild the result of scan_dir from a previous listing of
+       'dirpath', stat'ing the files instead of listing the directory;
+       None is returned if an entry has changed its kind (for instance a
+       symbolic link pointing now to a directory). Each stat is done
+       holding 'io_limit' (see FileReader).
+    """
+    dirpaths = []
+    file_entries = []
+    prefix = os.path.join(dirpath, '')
+    for dirname in dirnames:
+        subdirpath = prefix + dirname
+        with io_limit:
+            is_dir = os.path.isdir(subdirpath)
+        if not is_dir:
+            return None
+        dirpaths.append(subdirpath)
+    for filename in filenames:
+        filepath = prefix + filename
+        try:
+            with io_limit:
+                stat_result = os.stat(filepath)
+        except OSError:
+            with io_limit:
+                exists = os.path.lexists(filepath)
+            if not exists:
+                return None
+            stat_result = None
+        else:
+            if stat.S_ISDIR(stat_result.st_mode):
+                return None
+        file_entries.append(FileEntry(filepath=filepath, filename=filename, stat_result=stat_result))
+    return dirpaths, file_entries
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import codecs
+import contextlib
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# the io_limit of unlimited filesystem operations
+NO_IO_LIMIT = contextlib.nullcontext()
+SNIFF_SIZE = 8192
+MAX_CONTROL_RATIO = 0.3
+
+_BOM_ENCODINGS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+# control bytes that are not expected in text files (tab, newline,
+# vertical tab, form feed, carriage return and escape are allowed)
+_CONTROL_BYTES = bytes(byte for byte in range(32) if byte not in b'\t\n\v\f\r\x1b') + b'\x7f'
+
+def sniff_encoding(prefix):
+    """sniff_encoding(prefix) -> encoding or None
+       Guess if 'prefix', the first bytes of a file, is text or binary
+       data, without decoding it: a BOM tells the encoding; a NUL byte,
+       or too many control bytes, mean binary data (None is returned).
+       Text without BOM is decoded as utf-8, independently of the locale.
+    """
+    for bom, encoding in _BOM_ENCODINGS:
+        if prefix.startswith(bom):
+            return encoding
+    if b'\0' in prefix:
+        return None
+    num_control_bytes = len(prefix) - len(prefix.translate(None, _CONTROL_BYTES))
+    if num_control_bytes > len(prefix) * MAX_CONTROL_RATIO:
+        return None
+    return 'utf-8'
+
+class FileReader(object):
+    """FileReader(filepath, block_size=DEFAULT_BLOCK_SIZE, io_limit=NO_IO_LIMIT)
+       Read a file once, sequentially, in binary mode, for all the stages
+       that need its content. The file is opened when the content is first
+       needed, and the first read is only SNIFF_SIZE bytes long, so that
+       binary files are detected with a small read; the blocks read to
+       classify the file (usually only the first one or two) are kept, so
+       that text_lines() can be called more than once, and count_lines()
+       continues from them.
+       Each open and read is done holding 'io_limit' (a context manager,
+       for instance a semaphore), to limit the filesystem operations in
+       flight.
+    """
+    NEWLINE = b'\n'
+    def __init__(self, filepath, block_size=DEFAULT_BLOCK_SIZE, io_limit=NO_IO_LIMIT):
+        self.filepath = filepath
+        self.block_size = block_size
+        self.io_limit = io_limit
+        self._filehandle = None
+        self._blocks = []
+        self._eof = False
+        self._encoding = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._filehandle is not None:
+            self._filehandle.close()
+            self._filehandle = None
+        self._blocks = []
+
+    def _read_block(self):
+        if self._eof:
+            return None
+        with self.io_limit:
+            if self._filehandle is None:
+                self._filehandle = open(self.filepath, 'rb')
+                block = self._filehandle.read(min(SNIFF_SIZE, self.block_size))
+            else:
+                block = self._filehandle.read(self.block_size)
+        if not block:
+            self._eof = True
+            return None
+        return block
+
+    def _iter_blocks(self, keep):
+        for block in self._blocks:
+            yield block
+        while True:
+            block = self._read_block()
+            if block is None:
+                break
+            if keep:
+                self._blocks.append(block)
+            yield block
+
+    def head(self):
+        """head() -> the first block (at most SNIFF_SIZE bytes)"""
+        for block in self._iter_blocks(keep=True):
+            return block
+        return b''
+
+    def encoding(self):
+        """encoding() -> the encoding of the text, or None for binary data"""
+        if self._encoding is False:
+            self._encoding = sniff_encoding(self.head())
+        return self._encoding
+
+    def is_binary(self):
+        """is_binary() -> True if the file contains binary data"""
+        return self.encoding() is None
+
+    def text_lines(self):
+        """text_lines() -> iterator over the decoded lines
+           Undecodable bytes are replaced; the file should not be binary,
+           see is_binary().
+        """
+        decoder = codecs.getincrementaldecoder(self.encoding() or 'utf-8')(errors='replace')
+        line_start = ''
+        for block in self._iter_blocks(keep=True):
+            lines = (line_start + decoder.decode(block)).split('\n')
+            line_start = lines.pop(-1)
+            for line in lines:
+                yield line + '\n'
+        line_start += decoder.decode(b'', final=True)
+        if line_start:
+            yield line_start
+    def count_lines(self):
+        """count_lines() -> (num_lines, num_bytes)"""
+        num_lines = 0
+        num_bytes = 0
+        newline = self.NEWLINE
+        last_block = None
+        for block in self._iter_blocks(keep=False):
+            last_block = block
+            num_bytes += len(block)
+            num_lines += block.count(newline)
+        if last_block and last_block[-1] != newline:
+            num_lines += 1
+        return num_lines, num_bytes
@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import array
+import itertools
+
+from .stats import FileStats
+
+class FileRow(object):
+    """FileRow(file_table, index)
+       A read-only view of a row of a FileTable, with the attributes of
+       a classified ProjectFile.
+    """
+    __slots__ = ('file_table', 'index')
+    def __init__(self, file_table, index):
+        self.file_table = file_table
+        self.index = index
+
+    @property
+    def dirpath(self):
+        return self.file_table.dirpath(self.file_table.dir_ids[self.index])
+
+    @property
+    def filename(self):
+        return self.file_table.filename(self.index)
+
+    @property
+    def filepath(self):
+        return self.file_table.filepath(self.index)
+
+    @property
+    def filetype(self):
+        return self.file_table.filetypes[self.file_table.filetype_ids[self.index]]
+
+    @property
+    def qualifiers(self):
+        return self.file_table.qualifiers[self.file_table.qualifier_ids[self.index]]
+
+    @property
+    def file_stats(self):
+        file_table = self.file_table
+        index = self.index
+        return FileStats(lines=file_table.lines[index], bytes=file_table.bytes[index], uncounted=file_table.uncounted[index])
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(self.__class__.__name__, self.filepath, self.filetype)
+
+class FileTable(object):
+    """FileTable()
+       The per-file results of a tree, stored by column: filetype,
+       qualifiers and directory ids, and line and byte counts, are
+       arrays; file names are stored in a shared bytes buffer. Rows are
+       accessed through FileRow views.
+       Directories are stored as the id of the parent directory and the
+       leaf name, as ProjectDirs are; full paths are built on demand.
+       Removed rows are only marked as removed, and the columns are
+       compacted lazily, before the table is read as a whole; the rows of
+       each directory are indexed by name on the first lookup.
+    """
+    def __init__(self):
+        self.filetypes = []
+        self._filetype_ids = {}
+        self.qualifiers = [None]
+        self._qualifier_ids = {None: 0}
+        # the name of a directory without parent (-1) is its full path
+        self.dir_parent_ids = array.array('l')
+        self.dir_names = []
+        self._dir_ids = {}
+        self._last_dirpath = (None, None)
+        self.filetype_ids = array.array('H')
+        self.qualifier_ids = array.array('H')
+        self.dir_ids = array.array('L')
+        self.lines = array.array('q')
+        self.bytes = array.array('q')
+        self.uncounted = array.array('B')
+        # the name of row i is names[name_offsets[i]:name_offsets[i + 1]]
+        self.name_offsets = array.array('Q', [0])
+        self.names = bytearray()
+        # indices of the removed rows, dropped by compact()
+        self._removed = set()
+        # dir_id -> {encoded filename: index}, built by _rows_index()
+        self._dir_rows = None
+
+    def __len__(self):
+        return len(self.filetype_ids) - len(self._removed)
+
+    def compact(self):
+        """compact()
+           Drop the removed rows; the indices of the other rows change.
+        """
+        if not self._removed:
+            return
+        keep = [not index in self._removed for index in range(len(self.filetype_ids))]
+        names = bytearray()
+        name_offsets = array.array('Q', [0])
+        for index in itertools.compress(range(len(keep)), keep):
+            names += self.names[self.name_offsets[index]:self.name_offsets[index + 1]]
+            name_offsets.append(len(names))
+        self.names = names
+        self.name_offsets = name_offsets
+        for attribute in 'filetype_ids', 'qualifier_ids', 'dir_ids', 'lines', 'bytes', 'uncounted':
+            column = getattr(self, attribute)
+            setattr(self, attribute, array.array(column.typecode, itertools.compress(column, keep)))
+        self._removed = set()
+        self._dir_rows = None
+
+    def _rows_index(self):
+        dir_rows = self._dir_rows
+        if dir_rows is None:
+            dir_rows = self._dir_rows = {}
+            names = self.names
+            name_offsets = self.name_offsets
+            removed = self._removed
+            for index, dir_id in enumerate(self.dir_ids):
+                if not index in removed:
+                    name = bytes(names[name_offsets[index]:name_offsets[index + 1]])
+                    dir_rows.setdefault(dir_id, {})[name] = index
+        return dir_rows
+
+    def clear(self):
+        self.__init__()
+
+    def _filetype_id(self, filetype):
+        filetype_id = self._filetype_ids.get(filetype, None)
+        if filetype_id is None:
+            filetype_id = self._filetype_ids[filetype] = len(self.filetypes)
+            self.filetypes.append(filetype)
+        return filetype_id
+
+    def _qualifier_id(self, qualifiers):
+        qualifier_id = self._qualifier_ids.get(qualifiers, None)
+        if qualifier_id is None:
+            qualifier_id = self._qualifier_ids[qualifiers] = len(self.qualifiers)
+            self.qualifiers.append(qualifiers)
+        return qualifier_id
+
+    def _dir_id(self, parent_id, name):
+        key = (parent_id, name)
+        dir_id = self._dir_ids.get(key, None)
+        if dir_id is None:
+            dir_id = self._dir_ids[key] = len(self.dir_names)
+            self.dir_parent_ids.append(parent_id)
+            self.dir_names.append(name)
+        return dir_id
+
+    def project_dir_id(self, project_dir, register=True):
+        """project_dir_id(project_dir, register=True) -> dir_id
+           Return the id of a ProjectDir; if 'register' is False, None is
+           returned for unknown directories.
+        """
+        # iterative, since trees can be arbitrarily deep
+        names = []
+        while project_dir is not None:
+            names.append(project_dir.name)
+            project_dir = project_dir.path_parent
+        dir_id = -1
+        dir_ids = self._dir_ids
+        for name in reversed(names):
+            parent_id = dir_id
+            dir_id = dir_ids.get((parent_id, name), None)
+            if dir_id is None:
+                if not register:
+                    return None
+                dir_id = self._dir_id(parent_id, name)
+        return dir_id
+
+    def dirpath(self, dir_id):
+        # rows are grouped by directory, so the last path is kept
+        last_dir_id, dirpath = self._last_dirpath
+        if dir_id != last_dir_id:
+            names = []
+            parent_id = dir_id
+            while parent_id >= 0:
+                names.append(self.dir_names[parent_id])
+                parent_id = self.dir_parent_ids[parent_id]
+            dirpath = os.path.join(*reversed(names))
+            self._last_dirpath = (dir_id, dirpath)
+        return dirpath
+
+    def append(self, dir_id, filename, filetype, qualifiers, file_stats):
+        if self._dir_rows is not None:
+            self._dir_rows.setdefault(dir_id, {})[os.fsencode(filename)] = len(self.filetype_ids)
+        self.filetype_ids.append(self._filetype_id(filetype))
+        self.qualifier_ids.append(self._qualifier_id(qualifiers))
+        self.dir_ids.append(dir_id)
+        self.lines.append(file_stats.lines)
+        self.bytes.append(file_stats.bytes)
+        self.uncounted.append(file_stats.uncounted)
+        self.names += os.fsencode(filename)
+        self.name_offsets.append(len(self.names))
+
+    def append_project_file(self, project_file, dir_id=None):
+        """append_project_file(project_file, dir_id=None)
+           Append a classified ProjectFile.
+        """
+        if dir_id is None:
+            dir_id = self.project_dir_id(project_file.project_dir)
+        self.append(dir_id, project_file.filename, project_file.filetype, project_file.qualifiers, project_file.file_stats)
+
+    def extend(self, file_table):
+        """extend(file_table)
+           Append all the rows of another FileTable.
+        """
+        file_table.compact()
+        self.compact()
+        self._dir_rows = None
+        filetype_map = [self._filetype_id(filetype) for filetype in file_table.filetypes]
+        qualifier_map = [self._qualifier_id(qualifiers) for qualifiers in file_table.qualifiers]
+        dir_map = []
+        for parent_id, name in zip(file_table.dir_parent_ids, file_table.dir_names):
+            if parent_id >= 0:
+                parent_id = dir_map[parent_id]
+            dir_map.append(self._dir_id(parent_id, name))
+        for column, other_column, id_map in ((self.filetype_ids, file_table.filetype_ids, filetype_map),
+                                             (self.qualifier_ids, file_table.qualifier_ids, qualifier_map),
+                                             (self.dir_ids, file_table.dir_ids, dir_map)):
+            if id_map == list(range(len(id_map))):
+                column.extend(other_column)
+            else:
+                column.extend(id_map[other_id] for other_id in other_column)
+        self.lines.extend(file_table.lines)
+        self.bytes.extend(file_table.bytes)
+        self.uncounted.extend(file_table.uncounted)
+        names_offset = len(self.names)
+        self.names += file_table.names
+        if names_offset:
+            self.name_offsets.extend(names_offset + offset for offset in itertools.islice(file_table.name_offsets, 1, None))
+        else:
+            self.name_offsets.extend(itertools.islice(file_table.name_offsets, 1, None))
+
+    def filename(self, index):
+        return os.fsdecode(bytes(self.names[self.name_offsets[index]:self.name_offsets[index + 1]]))
+
+    def filepath(self, index):
+        return os.path.join(self.dirpath(self.dir_ids[index]), self.filename(index))
+
+    def row(self, index):
+        return FileRow(self, index)
+
+    def filepaths(self):
+        """filepaths() -> iterator over the paths of all the files"""
+        self.compact()
+        for index in range(len(self)):
+            yield self.filepath(index)
+
+    def filetype_rows(self):
+        """filetype_rows() -> dict filetype -> list of FileRows, in table order"""
+        self.compact()
+        rows = [[] for filetype in self.filetypes]
+        for index, filetype_id in enumerate(self.filetype_ids):
+            rows[filetype_id].append(FileRow(self, index))
+        return dict((filetype, filetype_rows) for filetype, filetype_rows in zip(self.filetypes, rows) if filetype_rows)
+
+    def find(self, project_dir, filename):
+        """find(project_dir, filename) -> index or None"""
+        dir_id = self.project_dir_id(project_dir, register=False)
+        if dir_id is None:
+            return None
+        return self._rows_index().get(dir_id, {}).get(os.fsencode(filename), None)
+
+    def remove(self, indices):
+        """remove(indices) -> removed FileRows
+           Remove rows; the returned rows belong to a new FileTable. The
+           removed rows are dropped when the table is compacted.
+        """
+        indices = set(indices) - self._removed
+        if not indices:
+            return []
+        removed = FileTable()
+        dir_rows = self._dir_rows
+        for index in sorted(indices):
+            dir_id = self.dir_ids[index]
+            name = bytes(self.names[self.name_offsets[index]:self.name_offsets[index + 1]])
+            removed.append(removed._dir_id(-1, self.dirpath(dir_id)), os.fsdecode(name),
+                           self.filetypes[self.filetype_ids[index]], self.qualifiers[self.qualifier_ids[index]],
+                           self.row(index).file_stats)
+            if dir_rows is not None:
+                rows = dir_rows.get(dir_id, None)
+                if rows is not None and rows.get(name, None) == index:
+                    del rows[name]
+                    if not rows:
+                        del dir_rows[dir_id]
+        self._removed.update(indices)
+        # compact when most of the rows are removed, so that memory is bounded
+        if len(self._removed) * 2 > len(self.filetype_ids):
+            self.compact()
+        return [removed.row(index) for index in range(len(removed))]
+
+    def remove_files(self, project_dir, filenames):
+        """remove_files(project_dir, filenames) -> removed FileRows"""
+        dir_id = self.project_dir_id(project_dir, register=False)
+        if dir_id is None:
+            return []
+        rows = self._rows_index().get(dir_id, {})
+        indices = (rows.get(os.fsencode(filename), None) for filename in set(filenames))
+        return self.remove(index for index in indices if index is not None)
+
+    def remove_dirs(self, project_dirs):
+        """remove_dirs(project_dirs) -> removed FileRows"""
+        dir_rows = self._rows_index()
+        indices = []
+        for project_dir in project_dirs:
+            dir_id = self.project_dir_id(project_dir, register=False)
+            if dir_id is not None:
+                indices.extend(dir_rows.get(dir_id, {}).values())
+        return self.remove(indices)
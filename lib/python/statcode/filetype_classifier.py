@@ -19,10 +19,16 @@ __author__ = 'Simone Campagna'
 
 import os
 import re
+import sys
 import fnmatch
 import collections
 
 from . import patternutils
+from . import keyword_scanner
+from . import keyword_scores
+from .aho_corasick import AhoCorasick
+from .file_reader import FileReader, NO_IO_LIMIT
+from .lru_cache import LRUCache
 from .filetype_config import FileTypeConfig
 
 class FileTypeClassifier(object):
@@ -36,20 +42,34 @@ class FileTypeClassifier(object):
     BINARY_FILES = {FILETYPE_DATA}
     NON_EXISTENT_FILES = {FILETYPE_BROKEN_LINK, FILETYPE_NO_FILE, FILETYPE_UNREADABLE}
     DEFAULT_CATEGORY = FileTypeConfig.DEFAULT_CATEGORY
+    KEYWORD_ENGINE_REGEX = 'regex'
+    KEYWORD_ENGINE_AHO_CORASICK = 'aho-corasick'
+    KEYWORD_ENGINES = (KEYWORD_ENGINE_REGEX, KEYWORD_ENGINE_AHO_CORASICK)
+    SCORE_BACKEND_PYTHON = 'python'
+    SCORE_BACKEND_NUMPY = 'numpy'
+    SCORE_BACKENDS = (SCORE_BACKEND_PYTHON, SCORE_BACKEND_NUMPY)
+    FILENAME_CACHE_SIZE = 16384
     def __init__(self, filetype_config, qualifier_config, parameters):
         self._parameters = dict(parameters)
         self._file_extensions = collections.defaultdict(set)
         self._file_extension_names = collections.defaultdict(set)
-        self._file_extension_matchers = collections.defaultdict(set)
+        self._file_extension_patterns = collections.defaultdict(list)
         self._file_names = collections.defaultdict(set)
-        self._file_matchers = collections.defaultdict(set)
+        self._file_patterns = collections.defaultdict(set)
         self._interpreter_names = collections.defaultdict(set)
-        self._interpreter_matchers = collections.defaultdict(set)
-        self._binary_filetypes = set()
-        self._filetype_category = collections.defaultdict(lambda : self.DEFAULT_CATEGORY)
+        self._interpreter_patterns = collections.defaultdict(set)
+        self._binary_filetypes = set(self.BINARY_FILES)
+        self._filetype_category = {}
         self._filetype_keywords = {}
-        self._keyword_res = {}
+        self._keyword_patterns = {}
+        self._literal_keywords = set()
+        self._keyword_index = {}
+        self._filetype_keyword_indices = {}
         self._keyword_filetypes = collections.defaultdict(set)
+        self._keyword_scanners = {}
+        self._filetype_keyword_matrices = {}
+        # most file names repeat in big trees (Makefile, __init__.py, ...)
+        self.filename_cache = LRUCache(self.FILENAME_CACHE_SIZE)
 
         # from filetype_config
         for filetype in filetype_config.sections():
@@ -66,10 +86,10 @@ class FileTypeClassifier(object):
                     if fnmatch.fnmatch(extension, patternext):
                         extensions.add(extension)
                 if patternutils.is_regular_expression(pattern):
-                    matcher = patternutils.get_matcher(pattern)
-                    self._file_matchers[matcher].add(filetype)
+                    self._file_patterns[pattern].add(filetype)
                     for extension in extensions:
-                        self._file_extension_matchers[extension].add(matcher)
+                        if not pattern in self._file_extension_patterns[extension]:
+                            self._file_extension_patterns[extension].append(pattern)
                 else:
                     self._file_names[pattern].add(filetype)
                     for extension in extensions:
@@ -77,8 +97,7 @@ class FileTypeClassifier(object):
             
             for pattern in filetype_config.string_to_list(section['interpreter_patterns']):
                 if patternutils.is_regular_expression(pattern):
-                    matcher = patternutils.get_matcher(pattern)
-                    self._interpreter_matchers[matcher].add(filetype)
+                    self._interpreter_patterns[pattern].add(filetype)
                 else:
                     self._interpreter_names[pattern].add(filetype)
 
@@ -86,16 +105,47 @@ class FileTypeClassifier(object):
             for keyword in filetype_config.string_to_list(section['keywords']):
                 self._keyword_filetypes[keyword].add(filetype)
                 keywords.add(keyword)
-                if not keyword in self._keyword_res:
-                    keyword_re = re.compile("(?<!\w)" + re.escape(keyword) + "(?!\w)")
-                    self._keyword_res[keyword] = keyword_re
+                if not keyword in self._keyword_patterns:
+                    self._keyword_patterns[keyword] = keyword_scanner.keyword_pattern(keyword)
+                    self._keyword_index[keyword] = len(self._keyword_index)
+                    self._literal_keywords.add(keyword)
             for regular_expression in filetype_config.string_to_list(section['regular_expressions']):
                 self._keyword_filetypes[regular_expression].add(filetype)
                 keywords.add(regular_expression)
-                if not regular_expression in self._keyword_res:
-                    regular_expression_re = re.compile(regular_expression)
-                    self._keyword_res[regular_expression] = regular_expression_re
+                if not regular_expression in self._keyword_patterns:
+                    re.compile(regular_expression)
+                    self._keyword_patterns[regular_expression] = regular_expression
+                    self._keyword_index[regular_expression] = len(self._keyword_index)
             self._filetype_keywords[filetype] = keywords
+            self._filetype_keyword_indices[filetype] = tuple(self._keyword_index[keyword] for keyword in keywords)
+
+        # the filename and interpreter patterns are compiled into single
+        # regular expressions, which return the first matching pattern
+        self._file_matcher = patternutils.PatternMatcher(self._file_patterns)
+        self._file_extension_matchers = dict((extension, patternutils.PatternMatcher(patterns)) for extension, patterns in self._file_extension_patterns.items())
+        self._interpreter_matcher = patternutils.PatternMatcher(self._interpreter_patterns)
+
+        keyword_engine = self._parameters.get('keyword_engine', self.KEYWORD_ENGINE_REGEX)
+        if keyword_engine == self.KEYWORD_ENGINE_AHO_CORASICK:
+            self._aho_corasick = AhoCorasick(self._literal_keywords)
+        elif keyword_engine == self.KEYWORD_ENGINE_REGEX:
+            self._aho_corasick = None
+        else:
+            raise ValueError("invalid keyword_engine {!r}; valid values are {}".format(keyword_engine, '|'.join(self.KEYWORD_ENGINES)))
+
+        score_backend = self._parameters.get('score_backend', self.SCORE_BACKEND_PYTHON)
+        if score_backend == self.SCORE_BACKEND_NUMPY:
+            numpy = keyword_scores.import_numpy()
+            if numpy is None:
+                raise ValueError("invalid score_backend {!r}: numpy is not available".format(score_backend))
+            self._filetype_row = dict((filetype, row) for row, filetype in enumerate(self._filetype_keyword_indices))
+            self._filetype_keyword_matrix = numpy.zeros((len(self._filetype_row), len(self._keyword_index)), dtype=numpy.int64)
+            for filetype, keyword_indices in self._filetype_keyword_indices.items():
+                self._filetype_keyword_matrix[self._filetype_row[filetype], list(keyword_indices)] = 1
+        elif score_backend == self.SCORE_BACKEND_PYTHON:
+            self._filetype_keyword_matrix = None
+        else:
+            raise ValueError("invalid score_backend {!r}; valid values are {}".format(score_backend, '|'.join(self.SCORE_BACKENDS)))
 
         # from qualifier_config
         self._qualifier = {}
@@ -104,33 +154,49 @@ class FileTypeClassifier(object):
  
 
     def get_category(self, filetype):
-        return self._filetype_category[filetype]
+        return self._filetype_category.get(filetype, self.DEFAULT_CATEGORY)
 
-    def classify(self, filepath, filename=None):
+    def classify(self, filepath, filename=None, stat_result=None, file_reader=None):
         filetypes = None
-        if not os.path.exists(os.path.realpath(filepath)):
-            if os.path.lexists(filepath):
-                return [], {self.FILETYPE_BROKEN_LINK}
-            else:
-                return [], {self.FILETYPE_NO_FILE}
+        if stat_result is None:
+            # the filesystem operations of the file are limited as its reads
+            io_limit = file_reader.io_limit if file_reader is not None else NO_IO_LIMIT
+            with io_limit:
+                exists = os.path.exists(os.path.realpath(filepath))
+            if not exists:
+                with io_limit:
+                    lexists = os.path.lexists(filepath)
+                if lexists:
+                    return [], {self.FILETYPE_BROKEN_LINK}
+                else:
+                    return [], {self.FILETYPE_NO_FILE}
 
         if filename is None:
             filename = os.path.basename(filepath)
    
-        fileroot, fileext = os.path.splitext(filename)
-        qualifiers, filetypes = self.classify_by_filename(filename, fileroot, fileext)
+        qualifiers, filetypes = self.classify_filename(filename)
 
         if filetypes is None:
-            try:
-                with open(filepath, 'r') as filehandle:
-                    filetypes = self.classify_by_shebang(filehandle, filepath, filename)
-            except UnicodeDecodeError:
-                filetypes = {self.FILETYPE_DATA}
-            except IOError:
-                filetypes = {self.FILETYPE_UNREADABLE}
+            if file_reader is None:
+                with FileReader(filepath) as file_reader:
+                    filetypes = self.classify_by_shebang_reader(file_reader, filepath, filename)
+            else:
+                filetypes = self.classify_by_shebang_reader(file_reader, filepath, filename)
 
         return qualifiers, filetypes
 
+    def classify_filename(self, filename):
+        """classify_filename(filename) -> (qualifiers, filetypes)
+           classify_by_filename, memoized in the filename_cache; the
+           qualifiers are a tuple, and the result must not be modified.
+        """
+        return self.filename_cache.lookup(filename, self._classify_filename)
+
+    def _classify_filename(self, filename):
+        fileroot, fileext = os.path.splitext(filename)
+        qualifiers, filetypes = self.classify_by_filename(filename, fileroot, fileext)
+        return tuple(qualifiers), filetypes
+
     def classify_by_filename(self, filename, fileroot, fileext):
         qualifiers = []
 
@@ -155,38 +221,62 @@ class FileTypeClassifier(object):
                     return self._file_names[filename]
             if fileext in self._file_extension_matchers:
                 # by file matcher
-                for matcher in self._file_extension_matchers[fileext]:
-                    if matcher(filename):
-                        return self._file_matchers[matcher]
+                pattern = self._file_extension_matchers[fileext](filename)
+                if pattern is not None:
+                    return self._file_patterns[pattern]
             return self._file_extensions[fileext]
         # by file name:
         if filename in self._file_names:
             return self._file_names[filename]
         # by file matcher:
-        for matcher, filetypes in self._file_matchers.items():
-            if matcher(filename):
-                return filetypes
+        pattern = self._file_matcher(filename)
+        if pattern is not None:
+            return self._file_patterns[pattern]
         return None
 
-    def classify_by_content(self, restrict_filetypes, filepath):
+    def classify_by_content(self, restrict_filetypes, filepath, file_reader=None):
+        if file_reader is None:
+            with FileReader(filepath) as file_reader:
+                return self.classify_by_content_reader(restrict_filetypes, filepath, file_reader)
+        else:
+            return self.classify_by_content_reader(restrict_filetypes, filepath, file_reader)
+
+    def classify_by_content_reader(self, restrict_filetypes, filepath, file_reader):
+        """classify_by_content_reader(restrict_filetypes, filepath, file_reader) -> filetypes
+           Binary data is detected from the first bytes of the file, then
+           the text lines are classified by content.
+        """
         try:
-            with open(filepath, 'r') as filehandle:
-                return self.classify_by_content_filehandle(restrict_filetypes, filepath, filehandle)
-        except UnicodeDecodeError:
-            return self.FILETYPE_DATA
+            if file_reader.is_binary():
+                return {self.FILETYPE_DATA}
+            return self.classify_by_content_filehandle(restrict_filetypes, filepath, file_reader.text_lines())
         except IOError:
-            return self.FILETYPE_UNREADABLE
+            return {self.FILETYPE_UNREADABLE}
+
+    def _get_keyword_scanner(self, filetypes, keywords):
+        key = frozenset(filetypes)
+        scanner = self._keyword_scanners.get(key, None)
+        if scanner is None:
+            if self._aho_corasick is not None:
+                scanner = keyword_scanner.AhoCorasickKeywordScanner(self._aho_corasick, keywords, self._keyword_patterns, self._literal_keywords, self._keyword_index)
+            else:
+                scanner = keyword_scanner.KeywordScanner(keywords, self._keyword_patterns, self._literal_keywords, self._keyword_index)
+            self._keyword_scanners[key] = scanner
+        return scanner
+
+    def _get_keyword_scores(self, filetypes):
+        if self._filetype_keyword_matrix is not None:
+            key = frozenset(filetypes)
+            entry = self._filetype_keyword_matrices.get(key, None)
+            if entry is None:
+                filetypes = tuple(filetypes)
+                matrix = self._filetype_keyword_matrix[[self._filetype_row[filetype] for filetype in filetypes]]
+                entry = (filetypes, matrix)
+                self._filetype_keyword_matrices[key] = entry
+            return keyword_scores.NumpyKeywordScores(*entry)
+        else:
+            return keyword_scores.KeywordScores(filetypes, self._filetype_keyword_indices, len(self._keyword_index))
 
-    def _sorted_filetype_scores(self, filetypes, keyword_scores):
-        filetype_scores = []
-        for filetype in filetypes:
-            filetype_score = 0
-            for keyword in self._filetype_keywords[filetype]:
-                filetype_score += keyword_scores[keyword]
-            filetype_scores.append((filetype, filetype_score))
-        filetype_scores.sort(key=lambda x: x[1], reverse=True)
-        return filetype_scores
-                
     def classify_by_content_filehandle(self, restrict_filetypes, filepath, filehandle):
         if len(restrict_filetypes) == 1:
             return {next(iter(restrict_filetypes))}
@@ -207,43 +297,33 @@ class FileTypeClassifier(object):
                 keywords.update(filetype_keywords)
         for keyword in keywords:
             keyword_filetypes[keyword] = self._keyword_filetypes[keyword].intersection(filetypes)
-        keyword_res = self._keyword_res
-        keyword_scores = dict((keyword, 0) for keyword in keywords)
-        #keyword_scores = collections.defaultdict(lambda : 0)
+        scan = self._get_keyword_scanner(filetypes, keywords).scan
+        scores = self._get_keyword_scores(filetypes)
+        keyword_counts = scores.counts
         non_keyword_filetypes = set(restrict_filetypes).difference(filetypes)
 
         #print(sorted(keywords))
         for line in filehandle:
             num_lines += 1
-            for keyword in keywords:
-                keyword_re = keyword_res[keyword]
-                score = 0
-                for m in keyword_re.finditer(line):
-                    #print("KKK", filetype, repr(keyword), num_lines, repr(m.group()), m.span())
-                    score += 1
-                if score:
-                    keyword_scores[keyword] += score
+            scan(line, keyword_counts)
             if num_lines > min_lines and (num_lines % block_lines == 0):
-                filetype_scores = self._sorted_filetype_scores(filetypes, keyword_scores)
-                if filetype_scores:
-                    first, first_score = filetype_scores[0]
+                if filetypes:
+                    first, first_score, second_score = scores.best_scores()
                     if first_score:
-                        if len(filetype_scores) > 1:
-                            second, second_score = filetype_scores[1]
-                            #print("###A", filepath, filetype_scores, keyword_scores)
+                        if second_score is not None:
                             if second_score:
-                                #print("!", filetype_scores, first_score, second_score, second_score / first_score)
+                                #print("!", first_score, second_score, second_score / first_score)
                                 if second_score / first_score < max_ratio:
-                                    #print("A", filepath, repr(first), first_score, repr(second), second_score)
+                                    #print("A", filepath, repr(first), first_score, second_score)
                                     return {first}
                         if first_score > num_lines * score_ratio:
-                            #print("B", filepath, repr(first), first_score, repr(second), second_score)
+                            #print("B", filepath, repr(first), first_score, second_score)
                             return {first}
             if num_lines > max_lines:
                 break
-        filetype_scores = self._sorted_filetype_scores(filetypes, keyword_scores)
+        filetype_scores = scores.sorted_filetype_scores()
         if filetype_scores:
-            #print("###B", filepath, filetype_scores, dict((k, v) for k, v in keyword_scores.items() if v), num_lines, num_lines * score_ratio)
+            #print("###B", filepath, filetype_scores, num_lines, num_lines * score_ratio)
             first, first_score = filetype_scores[0]
             if first_score >= num_lines * score_ratio:
                 result = set()
@@ -259,9 +339,17 @@ class FileTypeClassifier(object):
         else:
             return non_keyword_filetypes
 
+    def classify_by_shebang_reader(self, file_reader, filepath, filename):
+        try:
+            if file_reader.is_binary():
+                return {self.FILETYPE_DATA}
+            return self.classify_by_shebang(file_reader.text_lines(), filepath, filename)
+        except IOError:
+            return {self.FILETYPE_UNREADABLE}
+
     def classify_by_shebang(self, filehandle, filepath, filename):
         try:
-            first_line = filehandle.readline().rstrip()
+            first_line = next(iter(filehandle), '').rstrip()
             if first_line.startswith(self.SHEBANG):
                 fl = [e.strip() for e in first_line[len(self.SHEBANG):].split()]
                 if fl:
@@ -274,12 +362,11 @@ class FileTypeClassifier(object):
                 if interpreter in self._interpreter_names:
                     return self._interpreter_names[interpreter]
                 # by interpreter pattern
-                for matcher, filetypes in self._interpreter_matchers.items():
-                    if matcher(interpreter):
-                        return filetypes
-                        break
+                pattern = self._interpreter_matcher(interpreter)
+                if pattern is not None:
+                    return self._interpreter_patterns[pattern]
                 else:
-                    filetypes = {interpreter}
+                    filetypes = {sys.intern(interpreter)}
                     return filetypes
             else:
                 # no shebang
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_LIBC = None
+
+def _get_libc():
+    global _LIBC
+    if _LIBC is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        for function_name in 'inotify_init1', 'inotify_add_watch', 'inotify_rm_watch':
+            if not hasattr(libc, function_name):
+                raise OSError(errno.ENOSYS, "inotify is not available")
+        libc.inotify_init1.argtypes = (ctypes.c_int, )
+        libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+        _LIBC = libc
+    return _LIBC
+
+def _raise_errno(*args):
+    error = ctypes.get_errno()
+    raise OSError(error, os.strerror(error), *args)
+
+class Inotify(object):
+    """Inotify()
+       A minimal ctypes wrapper of the Linux inotify API; OSError is
+       raised where inotify is not available.
+    """
+    BUFFER_SIZE = 65536
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            _raise_errno()
+
+    def add_watch(self, path, mask):
+        """add_watch(path, mask) -> wd"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            _raise_errno(path)
+        return wd
+
+    def rm_watch(self, wd):
+        """rm_watch(wd)"""
+        if self._libc.inotify_rm_watch(self.fd, wd) < 0:
+            _raise_errno()
+
+    def read_events(self, timeout=None):
+        """read_events(timeout=None) -> list of (wd, mask, cookie, name)
+           Wait at most 'timeout' seconds (forever if None) for events.
+        """
+        events = []
+        readable, writable, exceptional = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return events
+        while True:
+            try:
+                data = os.read(self.fd, self.BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import re
+
+WORD_RE = re.compile(r'\w+')
+
+def is_word(keyword):
+    return WORD_RE.fullmatch(keyword) is not None
+
+def is_word_char(char):
+    # the same characters as \w in str patterns
+    return char.isalnum() or char == '_'
+
+def keyword_pattern(keyword):
+    return r"(?<!\w)" + re.escape(keyword) + r"(?!\w)"
+
+class KeywordScanner(object):
+    """KeywordScanner(keywords, keyword_patterns, literal_keywords, keyword_index)
+       Count the occurrences of many keywords with a single pass over each
+       line for the word keywords: the line is split in words by one
+       regular expression, and the word keywords are looked up in a dict.
+       All the other keywords (the literal keywords that are not a single
+       word, and the regular expressions) are matched each by its own
+       regular expression, as their matches can overlap: for instance,
+       '::' is found twice in 'a::b:::c' whatever the other keywords are.
+       'keyword_patterns' maps each keyword to its regular expression;
+       'literal_keywords' is the set of keywords that are not regular
+       expressions; 'keyword_index' maps each keyword to its index in the
+       keyword counts.
+    """
+    def __init__(self, keywords, keyword_patterns, literal_keywords, keyword_index):
+        self.keywords = frozenset(keywords)
+        literal_keywords = self.keywords.intersection(literal_keywords)
+        self._word_keywords = dict((keyword, keyword_index[keyword]) for keyword in literal_keywords if is_word(keyword))
+        # (literal or None, finditer, index); a literal keyword is searched
+        # only in the lines that contain it
+        self._other_keywords = []
+        for keyword in sorted(self.keywords.difference(self._word_keywords)):
+            literal = keyword if keyword in literal_keywords else None
+            finditer = re.compile(keyword_patterns[keyword]).finditer
+            self._other_keywords.append((literal, finditer, keyword_index[keyword]))
+
+    def scan(self, line, keyword_counts):
+        """scan(line, keyword_counts)
+           Add to 'keyword_counts' the number of occurrences of each keyword
+           in 'line'.
+        """
+        word_keywords = self._word_keywords
+        for word in WORD_RE.findall(line):
+            index = word_keywords.get(word, None)
+            if index is not None:
+                keyword_counts[index] += 1
+        for literal, finditer, index in self._other_keywords:
+            if literal is not None and not literal in line:
+                continue
+            for m in finditer(line):
+                keyword_counts[index] += 1
+
+class AhoCorasickKeywordScanner(object):
+    """AhoCorasickKeywordScanner(automaton, keywords, keyword_patterns, literal_keywords, keyword_index)
+       Count the occurrences of many keywords with a single scan of each
+       line by the Aho-Corasick 'automaton', which contains the
+       'literal_keywords' (of all the filetypes); the same word boundary
+       and non-overlapping rules of the keyword_pattern regular expressions
+       are applied to the matches. The remaining keywords (regular
+       expressions) are matched by a KeywordScanner.
+    """
+    def __init__(self, automaton, keywords, keyword_patterns, literal_keywords, keyword_index):
+        self.keywords = frozenset(keywords)
+        self._keyword_index = dict((keyword, keyword_index[keyword]) for keyword in self.keywords)
+        self._iter_matches = automaton.iter_matches
+        self._regex_scanner = KeywordScanner(self.keywords.difference(literal_keywords), keyword_patterns, (), keyword_index)
+
+    def scan(self, line, keyword_counts):
+        """scan(line, keyword_counts)
+           Add to 'keyword_counts' the number of occurrences of each keyword
+           in 'line'.
+        """
+        keyword_index = self._keyword_index
+        last_ends = {}
+        line_length = len(line)
+        for end, keyword in self._iter_matches(line):
+            if keyword in keyword_index:
+                start = end + 1 - len(keyword)
+                if start < last_ends.get(keyword, 0):
+                    continue
+                if start > 0 and is_word_char(line[start - 1]):
+                    continue
+                if end + 1 < line_length and is_word_char(line[end + 1]):
+                    continue
+                last_ends[keyword] = end + 1
+                keyword_counts[keyword_index[keyword]] += 1
+        self._regex_scanner.scan(line, keyword_counts)
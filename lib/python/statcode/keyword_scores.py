@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+# numpy is slow to import, so it is imported only when needed: users of
+# numpy import it themselves (cheap once it is in sys.modules), since
+# objects can be unpickled without import_numpy() ever being called.
+
+def import_numpy():
+    """import_numpy() -> the numpy module, or None if it is not available"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+class KeywordScores(object):
+    """KeywordScores(filetypes, filetype_keyword_indices, num_keywords)
+       Keyword counts of a file, and the resulting scores of the candidate
+       'filetypes'; the score of a filetype is the sum of the counts of its
+       keywords. Scores are computed in python.
+    """
+    def __init__(self, filetypes, filetype_keyword_indices, num_keywords):
+        self.filetypes = list(filetypes)
+        self.counts = [0] * num_keywords
+        self._filetype_keyword_indices = [filetype_keyword_indices[filetype] for filetype in self.filetypes]
+
+    def sorted_filetype_scores(self):
+        """sorted_filetype_scores() -> [(filetype, score), ...]
+           Sorted by decreasing score.
+        """
+        counts = self.counts
+        filetype_scores = []
+        for filetype, keyword_indices in zip(self.filetypes, self._filetype_keyword_indices):
+            filetype_score = 0
+            for index in keyword_indices:
+                filetype_score += counts[index]
+            filetype_scores.append((filetype, filetype_score))
+        filetype_scores.sort(key=lambda x: x[1], reverse=True)
+        return filetype_scores
+
+    def best_scores(self):
+        """best_scores() -> (first, first_score, second_score)
+           The filetype with the highest score, its score, and the second
+           highest score (None if there is only one filetype).
+        """
+        filetype_scores = self.sorted_filetype_scores()
+        first, first_score = filetype_scores[0]
+        if len(filetype_scores) > 1:
+            second_score = filetype_scores[1][1]
+        else:
+            second_score = None
+        return first, first_score, second_score
+
+class NumpyKeywordScores(object):
+    """NumpyKeywordScores(filetypes, matrix)
+       Keyword counts of a file, kept in a numpy vector; the scores of all
+       the candidate 'filetypes' are computed as one product with 'matrix',
+       which has a row for each filetype and a column for each keyword.
+    """
+    def __init__(self, filetypes, matrix):
+        import numpy
+        self.filetypes = list(filetypes)
+        self.counts = numpy.zeros(matrix.shape[1], dtype=numpy.int64)
+        self._matrix = matrix
+
+    def _scores(self):
+        return self._matrix.dot(self.counts)
+
+    def sorted_filetype_scores(self):
+        """sorted_filetype_scores() -> [(filetype, score), ...]
+           Sorted by decreasing score.
+        """
+        import numpy
+        scores = self._scores()
+        filetypes = self.filetypes
+        return [(filetypes[index], int(scores[index])) for index in numpy.argsort(-scores, kind='stable')]
+
+    def best_scores(self):
+        """best_scores() -> (first, first_score, second_score)
+           The filetype with the highest score, its score, and the second
+           highest score (None if there is only one filetype).
+        """
+        scores = self._scores()
+        first_index = int(scores.argmax())
+        first_score = int(scores[first_index])
+        if len(scores) > 1:
+            import numpy
+            second_score = int(numpy.partition(scores, -2)[-2])
+        else:
+            second_score = None
+        return self.filetypes[first_index], first_score, second_score
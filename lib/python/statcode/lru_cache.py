@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import threading
+import collections
+
+_MISSING = object()
+
+class LRUCache(object):
+    """LRUCache(maxsize)
+       A thread-safe cache that keeps the 'maxsize' most recently used
+       entries, and counts hits and misses.
+       Hits do not take the lock: reading an entry and moving it to the
+       end are single, atomic OrderedDict operations, so under concurrent
+       access the worst case is a slightly stale recency order (and
+       approximate counters); insertion and eviction are serialized.
+    """
+    def __init__(self, maxsize):
+        if maxsize < 0:
+            raise ValueError("invalid maxsize {!r}; it must be >= 0".format(maxsize))
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, key, function):
+        """lookup(key, function) -> value
+           Return the cached value for 'key'; on a miss, the value is
+           computed as function(key), outside the lock, and stored.
+        """
+        entries = self._entries
+        value = entries.get(key, _MISSING)
+        if value is not _MISSING:
+            try:
+                entries.move_to_end(key)
+            except KeyError:
+                # evicted meanwhile
+                pass
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = function(key)
+        if self.maxsize > 0:
+            with self._lock:
+                entries[key] = value
+                while len(entries) > self.maxsize:
+                    entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __getstate__(self):
+        # the entries and the lock are not pickled
+        return (self.maxsize, self.hits, self.misses)
+
+    def __setstate__(self, state):
+        maxsize, hits, misses = state
+        self.__init__(maxsize)
+        self.hits = hits
+        self.misses = misses
@@ -39,9 +39,39 @@ def get_matcher(pattern):
         _CACHED[pattern] = re.compile(fnmatch.translate(pattern)).match
     return _CACHED[pattern]
 
-def filter_patterns(patterns):
+class PatternMatcher(object):
+    """PatternMatcher(patterns)
+       All the fnmatch 'patterns' compiled into a single regular
+       expression; calling it with a value returns the first matching
+       pattern, or None.
+    """
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        if self.patterns:
+            regex = '|'.join('(?P<_p{}>{})'.format(index, fnmatch.translate(pattern)) for index, pattern in enumerate(self.patterns))
+        else:
+            regex = '(?!)'
+        self._match = re.compile(regex).match
+
+    def __call__(self, value):
+        match = self._match(value)
+        if match is None:
+            return None
+        return self.patterns[int(match.lastgroup[2:])]
+
+def filter_patterns(patterns, combine=False):
+    """filter_patterns(patterns, combine=False) -> (names, matchers)
+       Split 'patterns' into plain names and matchers; if 'combine' is
+       True, all the matchers are compiled into a single PatternMatcher.
+    """
     matchers = set()
     names = set()
+    if combine:
+        regular_expressions = sorted(set(pattern for pattern in patterns if is_regular_expression(pattern)))
+        names.update(pattern for pattern in patterns if not is_regular_expression(pattern))
+        if regular_expressions:
+            matchers.add(PatternMatcher(regular_expressions))
+        return names, matchers
     for pattern in patterns:
         if is_regular_expression(pattern):
             matchers.add(get_matcher(pattern))
@@ -20,14 +20,18 @@ __author__ = 'Simone Campagna'
 import os
 import abc
 import fnmatch
+import threading
 import collections
 
 from .stats import FileStats, DirStats, TreeStats
 from .filetype_classifier import FileTypeClassifier
 from .statcode_config import StatCodeConfig
+from .project_configuration import ProjectConfiguration
 from .project_file import ProjectFile
+from .file_reader import NO_IO_LIMIT
 from .project_dir import ProjectDir
 from .project_tree import ProjectTree, BaseTree
+from .project_shard import ShardedProjectTree, scan_projects
 from . import patternutils
 
 DirEntry = collections.namedtuple('DirEntry', ('category', 'filetype', 'files', 'lines', 'bytes'))
@@ -57,35 +61,34 @@ class SortKey(object):
     def choices(cls):
         return '|'.join("[+-]{}".format(k) for k in cls.FIELDS)
 
-class ProjectConfiguration(object):
-    def __init__(self, config):
-        if isinstance(config, str):
-            config = StatCodeConfig(config)
-        assert isinstance(config, StatCodeConfig)
-        self.config = config
-        self.filetype_config = self.config.get_filetype_config()
-        self.qualifier_config = self.config.get_qualifier_config()
-        self.directory_config = self.config.get_directory_config()
-        self.parameters = {}
-        self.parameters['min_lines'] = config.getint('parameters', 'min_lines')
-        self.parameters['max_lines'] = config.getint('parameters', 'max_lines')
-        self.parameters['max_ratio'] = config.getfloat('parameters', 'max_ratio')
-        self.parameters['score_ratio'] = config.getfloat('parameters', 'score_ratio')
-        self.parameters['block_lines'] = config.getint('parameters', 'block_lines')
-        self.filetype_classifier = FileTypeClassifier(self.filetype_config, self.qualifier_config, self.parameters)
+    def __str__(self):
+        if self.reverse:
+            return '-' + self.key
+        else:
+            return self.key
 
 class BaseProject(BaseTree, metaclass=abc.ABCMeta):
     def __init__(self, configuration, name):
         assert isinstance(configuration, ProjectConfiguration)
         self.configuration = configuration
         self.config = self.configuration.config
-        self.filetype_config = self.configuration.filetype_config
-        self.qualifier_config = self.configuration.qualifier_config
-        self.directory_config = self.configuration.directory_config
         self.filetype_classifier = self.configuration.filetype_classifier
         self.name = name
         super().__init__()
 
+    # the config files are parsed only if needed, see ProjectConfiguration
+    @property
+    def filetype_config(self):
+        return self.configuration.filetype_config
+
+    @property
+    def qualifier_config(self):
+        return self.configuration.qualifier_config
+
+    @property
+    def directory_config(self):
+        return self.configuration.directory_config
+
     def project_entry(self):
         return ProjectEntry(projects=self.num_projects(), files=self.tree_stats.files, lines=self.tree_stats.lines, bytes=self.tree_stats.bytes)
 
@@ -141,9 +144,9 @@ class BaseProject(BaseTree, metaclass=abc.ABCMeta):
             select_filetypes = []
         if category_actions is None:
             category_actions = []
-        filetypes = sorted(self.tree_filetype_project_files.keys(), key=lambda x: x.lower())
+        filetypes = sorted(self.tree_filetype_stats.keys(), key=lambda x: x.lower())
         fmt_header = "{category:16} {filetype:16} {files:>12s} {lines:>12s} {bytes:>12s}"
-        fmt_body = "{category:16} {filetype:16} {files:12d} {lines:12d} {bytes:12d}"
+        fmt_body = "{category:16} {filetype:16} {files:12d} {lines:>12s} {bytes:12d}"
         print_function(fmt_header.format(category='CATEGORY', filetype='FILETYPE', files='#FILES', lines='#LINES', bytes='#BYTES', null=''))
         table = []
         tree_stats = TreeStats()
@@ -168,30 +171,35 @@ class BaseProject(BaseTree, metaclass=abc.ABCMeta):
                 for filetype in filetypes:
                     category_stats += self.tree_filetype_stats[filetype]
                 category_filetype = ''
-            table.append(DirEntry(
+            table.append((DirEntry(
                 category=category,
                 filetype=category_filetype,
                 files=category_stats.files,
                 lines=category_stats.lines,
-                bytes=category_stats.bytes))
+                bytes=category_stats.bytes), category_stats))
             tree_stats += category_stats
 
-        table.sort(key=lambda x: x.filetype)
+        table.sort(key=lambda x: x[0].filetype)
         if sort_keys:
             for sort_key in sort_keys:
                 assert isinstance(sort_key, SortKey)
                 if not sort_key.key in DirEntry._fields:
                     continue
-                table.sort(key=lambda x: getattr(x, sort_key.key), reverse=sort_key.reverse)
+                table.sort(key=lambda x: getattr(x[0], sort_key.key), reverse=sort_key.reverse)
 
-        for entry in table:
-            print_function(fmt_body.format(category=entry.category, filetype=entry.filetype, files=entry.files, lines=entry.lines, bytes=entry.bytes, null=''))
-        print_function(fmt_body.format(category='', filetype='TOTAL', files=tree_stats.files, lines=tree_stats.lines, bytes=tree_stats.bytes, null=''))
+        for entry, stats in table:
+            print_function(fmt_body.format(category=entry.category, filetype=entry.filetype, files=entry.files, lines=stats.lines_str(), bytes=entry.bytes, null=''))
+        print_function(fmt_body.format(category='', filetype='TOTAL', files=tree_stats.files, lines=tree_stats.lines_str(), bytes=tree_stats.bytes, null=''))
+        self._print_uncounted(tree_stats, print_function=print_function)
         print_function()
 
+    def _print_uncounted(self, stats, *, print_function=print):
+        if stats.uncounted:
+            print_function("(*) lines not counted for {} files".format(stats.uncounted))
+
     def list_filetype_files(self, filetype_patterns, *, print_function=print, sort_keys=None):
-        all_filetypes = set(self.tree_filetype_project_files.keys())
-        filetypes = patternutils.apply_signed_patterns(set(self.tree_filetype_project_files.keys()), filetype_patterns)
+        all_filetypes = set(self.tree_filetype_stats.keys())
+        filetypes = patternutils.apply_signed_patterns(set(self.tree_filetype_stats.keys()), filetype_patterns)
         self.list_filetypes_files(filetypes, print_function=print_function, sort_keys=sort_keys)
 
     def list_filetypes_files(self, filetypes, *, print_function=print, sort_keys=None):
@@ -199,56 +207,47 @@ class BaseProject(BaseTree, metaclass=abc.ABCMeta):
             print("=== Project[{}]".format(self.name))
 
         fmt_header = "{category:16} {filetype:16s} {lines:>12s} {bytes:>12s} {file}"
-        fmt_body = "{category:16} {filetype:16s} {lines:12d} {bytes:12d} {file}"
+        fmt_body = "{category:16} {filetype:16s} {lines:>12s} {bytes:12d} {file}"
         print_function(fmt_header.format(category='CATEGORY', filetype='FILETYPE', lines='#LINES', bytes='#BYTES', file='FILENAME', null=''))
         table = []
         tree_stats = TreeStats()
+        filetype_rows = self.file_table.filetype_rows()
         for filetype in filetypes:
-            if not filetype in self.tree_filetype_project_files:
+            if not filetype in filetype_rows:
                 continue
             category = self.filetype_classifier.get_category(filetype)
-            for project_file in self.tree_filetype_project_files[filetype]:
-                stats = project_file.file_stats
+            for file_row in filetype_rows[filetype]:
+                stats = file_row.file_stats
                 tree_stats += stats
-                table.append(FileEntry(category=category, filetype=filetype, lines=stats.lines, bytes=stats.bytes, filepath=project_file.filepath))
+                table.append((FileEntry(category=category, filetype=filetype, lines=stats.lines, bytes=stats.bytes, filepath=file_row.filepath), stats))
     
-        table.sort(key=lambda x: x.filetype)
+        table.sort(key=lambda x: x[0].filetype)
         if sort_keys:
             for sort_key in sort_keys:
                 assert isinstance(sort_key, SortKey)
                 if not sort_key.key in FileEntry._fields:
                     continue
-                table.sort(key=lambda x: getattr(x, sort_key.key), reverse=sort_key.reverse)
+                table.sort(key=lambda x: getattr(x[0], sort_key.key), reverse=sort_key.reverse)
 
-        for entry in table:
-            print_function(fmt_body.format(category=entry.category, filetype=entry.filetype, lines=entry.lines, bytes=entry.bytes, file=entry.filepath, null=''))
-        print_function(fmt_body.format(category='', filetype='TOTAL', lines=tree_stats.lines, bytes=tree_stats.bytes, file='', null=''))
+        for entry, stats in table:
+            print_function(fmt_body.format(category=entry.category, filetype=entry.filetype, lines=stats.lines_str(), bytes=entry.bytes, file=entry.filepath, null=''))
+        print_function(fmt_body.format(category='', filetype='TOTAL', lines=tree_stats.lines_str(), bytes=tree_stats.bytes, file='', null=''))
+        self._print_uncounted(tree_stats, print_function=print_function)
         print_function()
 
 
 
 class Project(BaseProject):
-    def __init__(self, configuration, project_dir, filetype_hints=None, block_size=None, progress_bar=None, progress_bar_level=1):
+    def __init__(self, configuration, project_dir, filetype_hints=None, block_size=None, progress_bar=None, progress_bar_level=1, jobs=None, processes=None, scan_cache=None, aggregate_only=False, async_ops=None, pipeline_workers=None):
         super().__init__(configuration, project_dir)
         self.project_dir = project_dir
-        filetype_config = self.filetype_config
-        directory_config = self.directory_config
-        qualifier_config = self.qualifier_config
 
         if filetype_hints is None:
             filetype_hints = ()
-        self.exclude_dir_names = set()
-        self.exclude_dir_matchers = set()
-        self.exclude_file_names = set()
-        self.exclude_file_matchers = set()
-        for section_name in directory_config.sections():
-            section = directory_config[section_name]
-            dir_names, dir_matchers = patternutils.filter_patterns(directory_config.string_to_list(section['exclude_dir_patterns']))
-            self.exclude_dir_names.update(dir_names)
-            self.exclude_dir_matchers.update(dir_matchers)
-            file_names, file_matchers = patternutils.filter_patterns(directory_config.string_to_list(section['exclude_file_patterns']))
-            self.exclude_file_names.update(file_names)
-            self.exclude_file_matchers.update(file_matchers)
+        self.exclude_dir_names = self.configuration.exclude_dir_names
+        self.exclude_dir_matchers = self.configuration.exclude_dir_matchers
+        self.exclude_file_names = self.configuration.exclude_file_names
+        self.exclude_file_matchers = self.configuration.exclude_file_matchers
         assert isinstance(filetype_hints, collections.Sequence)
         self._filetype_hints = filetype_hints
         self._directories = {}
@@ -257,18 +256,54 @@ class Project(BaseProject):
         self.block_size = block_size
         self.progress_bar = progress_bar
         self.progress_bar_level = progress_bar_level
+        self.jobs = jobs
+        self.processes = processes
+        self.async_ops = async_ops
+        # in asyncio mode, at most async_ops filesystem operations are in
+        # flight, see ProjectTree._classify_async
+        if async_ops is not None and async_ops > 0:
+            self.io_limit = threading.BoundedSemaphore(async_ops)
+        else:
+            self.io_limit = NO_IO_LIMIT
+        self.pipeline_workers = pipeline_workers
+        self.scan_cache = scan_cache
+        self.aggregate_only = aggregate_only
         self.classify()
 
     def num_projects(self):
         return 1
 
     def classify(self):
-        self.project_tree = ProjectTree(self.project_dir, None, self)
+        scan_cache = self.scan_cache
+        if scan_cache is not None:
+            scan_cache.load(self.project_dir)
+        if self.processes is not None and self.processes > 1:
+            self.project_tree = ShardedProjectTree(self.project_dir, None, self)
+        else:
+            self.project_tree = ProjectTree(self.project_dir, None, self)
         self.merge_tree(self.project_tree)
+        if scan_cache is not None:
+            scan_cache.save(self.project_dir)
 
     def filetype_hints(self):
         return iter(self._filetype_hints)
 
+class ScannedProject(BaseProject):
+    """ScannedProject(configuration, project_dir, tree, projects=1)
+       A project scanned elsewhere, for instance in a worker process or
+       loaded from a tree file: it has the results of 'tree' (see
+       BaseTree), but not the ProjectDirs, so it cannot be watched.
+       'projects' is the number of projects merged in 'tree'.
+    """
+    def __init__(self, configuration, project_dir, tree, projects=1):
+        super().__init__(configuration, project_dir)
+        self.project_dir = project_dir
+        self._num_projects = projects
+        self.merge_tree(tree)
+
+    def num_projects(self):
+        return self._num_projects
+
 class MetaProject(BaseProject):
     def __init__(self, configuration, projects=None, progress_bar=None, progress_bar_level=1):
         super().__init__(configuration, 'MetaProject')
@@ -283,6 +318,21 @@ class MetaProject(BaseProject):
         self.merge_project(project)
         self.projects.append(project)
             
+    def scan_projects(self, project_dirs, processes, *, filetype_hints=None, block_size=None, scan_cache=None, aggregate_only=False):
+        """scan_projects(project_dirs, processes, ...) -> iterator over the added ScannedProjects
+           Scan 'project_dirs' concurrently on 'processes' worker processes,
+           and add them as they complete; the projects are added in the
+           order of 'project_dirs', so that the reports are the same as if
+           they were scanned one after the other.
+        """
+        if filetype_hints is None:
+            filetype_hints = ()
+        for project_dir, tree in scan_projects(self.configuration, project_dirs, processes, filetype_hints=filetype_hints,
+                                               block_size=block_size, scan_cache=scan_cache, aggregate_only=aggregate_only):
+            project = ScannedProject(self.configuration, project_dir, tree)
+            self.add_project(project)
+            yield project
+
     def num_projects(self):
         return sum((project.num_projects() for project in self.projects), 0)
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import io
+import pickle
+import fnmatch
+import hashlib
+import tempfile
+
+from .filetype_classifier import FileTypeClassifier
+from .statcode_config import StatCodeConfig
+from . import patternutils
+
+class ProjectConfiguration(object):
+    """ProjectConfiguration(config, compiled_dir=None)
+       The configuration of a project, and what is built from it: the
+       FileTypeClassifier and the exclude matchers.
+       If 'compiled_dir' is given, what is built is pickled there, keyed
+       by compiled_key, and loaded by the next instances with the same
+       configuration, without parsing the filetype, qualifier and
+       directory config files. Only the file of the last configuration
+       stored is kept.
+    """
+    # increase when the pickled data change
+    COMPILED_VERSION = '1'
+    def __init__(self, config, compiled_dir=None):
+        if isinstance(config, str):
+            config = StatCodeConfig(config)
+        assert isinstance(config, StatCodeConfig)
+        self.config = config
+        self.compiled_dir = compiled_dir
+        self._filetype_config = None
+        self._qualifier_config = None
+        self._directory_config = None
+        compiled = None
+        if compiled_dir is not None:
+            compiled_filename = os.path.join(compiled_dir, 'classifier-{}.pickle'.format(self.compiled_key()))
+            compiled = self._load_compiled(compiled_filename)
+        if compiled is None:
+            compiled = self._compile()
+            if compiled_dir is not None:
+                self._store_compiled(compiled_filename, compiled)
+        self.parameters = compiled['parameters']
+        self.stat_only_binary = compiled['stat_only_binary']
+        self.stat_only_size = compiled['stat_only_size']
+        self.filetype_classifier = compiled['filetype_classifier']
+        self.exclude_dir_names = compiled['exclude_dir_names']
+        self.exclude_dir_matchers = compiled['exclude_dir_matchers']
+        self.exclude_file_names = compiled['exclude_file_names']
+        self.exclude_file_matchers = compiled['exclude_file_matchers']
+
+    @property
+    def filetype_config(self):
+        if self._filetype_config is None:
+            self._filetype_config = self.config.get_filetype_config()
+        return self._filetype_config
+
+    @property
+    def qualifier_config(self):
+        if self._qualifier_config is None:
+            self._qualifier_config = self.config.get_qualifier_config()
+        return self._qualifier_config
+
+    @property
+    def directory_config(self):
+        if self._directory_config is None:
+            self._directory_config = self.config.get_directory_config()
+        return self._directory_config
+
+    def _compile(self):
+        config = self.config
+        compiled = {}
+        parameters = {}
+        parameters['min_lines'] = config.getint('parameters', 'min_lines')
+        parameters['max_lines'] = config.getint('parameters', 'max_lines')
+        parameters['max_ratio'] = config.getfloat('parameters', 'max_ratio')
+        parameters['score_ratio'] = config.getfloat('parameters', 'score_ratio')
+        parameters['block_lines'] = config.getint('parameters', 'block_lines')
+        parameters['keyword_engine'] = config.get('parameters', 'keyword_engine')
+        parameters['score_backend'] = config.get('parameters', 'score_backend')
+        compiled['parameters'] = parameters
+        compiled['stat_only_binary'] = config.getboolean('parameters', 'stat_only_binary')
+        compiled['stat_only_size'] = config.getint('parameters', 'stat_only_size')
+        compiled['filetype_classifier'] = FileTypeClassifier(self.filetype_config, self.qualifier_config, parameters)
+        # the exclude patterns of all the sections are compiled into a
+        # single matcher, so that each entry is matched with one call
+        exclude_dir_patterns = []
+        exclude_file_patterns = []
+        directory_config = self.directory_config
+        for section_name in directory_config.sections():
+            section = directory_config[section_name]
+            exclude_dir_patterns.extend(directory_config.string_to_list(section['exclude_dir_patterns']))
+            exclude_file_patterns.extend(directory_config.string_to_list(section['exclude_file_patterns']))
+        compiled['exclude_dir_names'], compiled['exclude_dir_matchers'] = patternutils.filter_patterns(exclude_dir_patterns, combine=True)
+        compiled['exclude_file_names'], compiled['exclude_file_matchers'] = patternutils.filter_patterns(exclude_file_patterns, combine=True)
+        return compiled
+
+    def _load_compiled(self, compiled_filename):
+        # a missing, unreadable or incompatible file is simply rebuilt
+        try:
+            with open(compiled_filename, 'rb') as f_in:
+                return pickle.load(f_in)
+        except Exception:
+            return None
+
+    def _store_compiled(self, compiled_filename, compiled):
+        try:
+            if not os.path.isdir(self.compiled_dir):
+                os.makedirs(self.compiled_dir)
+            fd, tmp_filename = tempfile.mkstemp(dir=self.compiled_dir, prefix='.classifier-')
+            try:
+                with os.fdopen(fd, 'wb') as f_out:
+                    pickle.dump(compiled, f_out, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_filename, compiled_filename)
+            except BaseException:
+                os.unlink(tmp_filename)
+                raise
+            # the files of other configurations or statcode versions would
+            # pile up, since the key changes at each edit
+            compiled_basename = os.path.basename(compiled_filename)
+            for filename in os.listdir(self.compiled_dir):
+                if fnmatch.fnmatch(filename, 'classifier-*.pickle') and filename != compiled_basename:
+                    try:
+                        os.unlink(os.path.join(self.compiled_dir, filename))
+                    except OSError:
+                        pass
+        except OSError:
+            # the compiled configuration is only an optimization
+            pass
+
+    def config_key(self):
+        """config_key() -> a hash of the configuration
+           Directories listed, and files classified and counted, with the
+           same config_key have the same results, see ScanCache. The hash
+           covers the statcode config and the content of all the
+           filetype, qualifier and directory config files.
+        """
+        digest = hashlib.sha1()
+        stream = io.StringIO()
+        self.config.write(stream)
+        digest.update(stream.getvalue().encode('utf-8'))
+        for key in StatCodeConfig.__keys__:
+            for config_file in self.config.get_key_config_files(key):
+                digest.update('\0{}\0{}\0'.format(key, config_file).encode('utf-8'))
+                with open(config_file, 'rb') as f_in:
+                    digest.update(f_in.read())
+        return digest.hexdigest()
+
+    def compiled_key(self):
+        """compiled_key() -> the config_key, combined with the version of
+           the statcode modules (their size and modification time).
+        """
+        digest = hashlib.sha1()
+        digest.update('{}\0{}\0'.format(self.COMPILED_VERSION, self.config_key()).encode('utf-8'))
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        for filename in sorted(os.listdir(package_dir)):
+            if filename.endswith('.py'):
+                stat_result = os.stat(os.path.join(package_dir, filename))
+                digest.update('{}\0{}\0{}\0'.format(filename, stat_result.st_size, stat_result.st_mtime_ns).encode('utf-8'))
+        return digest.hexdigest()
@@ -18,6 +18,7 @@
 __author__ = 'Simone Campagna'
 
 import os
+import sys
 import fnmatch
 import collections
 
@@ -25,29 +26,51 @@ from .filetype_classifier import FileTypeClassifier
 from .project_file import ProjectFile
 from .stats import DirStats, TreeStats
 from . import patternutils
+from . import dirscan
 
 class ProjectDir(object):
+    __slots__ = ('name', 'path_parent', '_dirpath', 'parent', 'project', 'filetype', 'registered_files', 'dir_filetype_stats', 'dir_stats',
+                 'project_dirs', 'project_files', 'level', 'progress_bar')
     def __init__(self, dirpath, parent, project, filetype=None):
-        self.dirpath = dirpath
+        # the path is stored as the parent ProjectDir and the leaf name
+        if isinstance(parent, ProjectDir):
+            self.path_parent = parent
+            self.name = sys.intern(os.path.basename(dirpath))
+        else:
+            self.path_parent = None
+            self.name = dirpath
+        # the full path is cached only while the files are classified
+        self._dirpath = None
         self.parent = parent
         self.project = project
         self.filetype = filetype
-        self.dir_filetype_project_files = collections.defaultdict(list)
+        # the classified files, in registration order, until they are
+        # added to the file tables of the trees (see release_files)
+        self.registered_files = []
         self.dir_filetype_stats = collections.defaultdict(DirStats)
         self.dir_stats = DirStats()
         self.project_dirs = []
         self.project_files = []
         if self.parent:
             self.level = self.parent.level + 1
-            self.parent_progress_bar = getattr(self.parent, 'progress_bar', None)
         else:
             self.level = 0
-            self.parent_progress_bar = self.project.progress_bar
-        self.pre_classify()
+        self.progress_bar = None
+
+    @property
+    def dirpath(self):
+        names = []
+        project_dir = self
+        while project_dir._dirpath is None:
+            names.append(project_dir.name)
+            project_dir = project_dir.path_parent
+            if project_dir is None:
+                return os.path.join(*reversed(names))
+        return os.path.join(project_dir._dirpath, *reversed(names))
 
     def most_common_filetypes(self):
-        filetypes = set(self.dir_filetype_project_files.keys()).difference(FileTypeClassifier.NO_FILETYPE_FILES)
-        l = sorted(((filetype, len(self.dir_filetype_project_files[filetype])) for filetype in filetypes),
+        filetypes = set(self.dir_filetype_stats.keys()).difference(FileTypeClassifier.NO_FILETYPE_FILES)
+        l = sorted(((filetype, self.dir_filetype_stats[filetype].files) for filetype in filetypes),
                     key=lambda x: -x[-1])
         for filetype, num_files in l:
             yield filetype
@@ -55,17 +78,78 @@ class ProjectDir(object):
     def filetype_hints(self):
         return self.project.filetype_hints()
 
+    def walk(self, detach=False):
+        """walk(detach=False) -> iterator over this ProjectDir and all its subdirectories, in preorder
+           If 'detach' is True, the subdirectories are removed from their
+           parent once visited, so that only the directories on the
+           current path, and their pending siblings, are kept alive.
+        """
+        project_dirs = [self]
+        while project_dirs:
+            project_dir = project_dirs.pop()
+            yield project_dir
+            project_dirs.extend(reversed(project_dir.project_dirs))
+            if detach:
+                project_dir.project_dirs = []
+
+    def walk_ahead(self, start_listing, lookahead):
+        """walk_ahead(start_listing, lookahead) -> iterator over (project_dir, handle), in preorder
+           As walk(), but the listing of the next 'lookahead' directories
+           to visit is started in advance: start_listing(project_dir)
+           returns a handle, which must be waited for (the directory must
+           be listed) before the iteration is resumed. The subdirectories
+           are never detached.
+        """
+        handles = {}
+        project_dirs = [self]
+        while project_dirs:
+            # the next directories to visit are on top of the stack
+            for project_dir in project_dirs[-lookahead:]:
+                if not project_dir in handles:
+                    handles[project_dir] = start_listing(project_dir)
+            project_dir = project_dirs.pop()
+            yield project_dir, handles.pop(project_dir)
+            project_dirs.extend(reversed(project_dir.project_dirs))
+
     def _add_dir(self, dirpath):
         project_dir = ProjectDir(dirpath, self, self.project, filetype=self.filetype)
         self.project_dirs.append(project_dir)
 
-    def _add_file(self, filepath):
-        project_file = ProjectFile(filepath, self, filetype=self.filetype)
+    def _add_file(self, file_entry):
+        project_file = ProjectFile(file_entry.filepath, self, filetype=self.filetype, filename=file_entry.filename, stat_result=file_entry.stat_result)
         self.project_files.append(project_file)
 
     def _register_project_file(self, project_file):
         #print("reg: ", project_file.filepath, project_file.filetype, project_file.file_stats)
-        self.dir_filetype_project_files[project_file.filetype].append(project_file)
+        self.registered_files.append(project_file)
+        self.dir_filetype_stats[project_file.filetype] += project_file.file_stats
+
+    def add_project_file(self, project_file):
+        """add_project_file(project_file)
+           Add a classified file to an already classified directory; the
+           file is not kept (see BaseTree.add_project_files).
+        """
+        self.dir_stats += project_file.file_stats
+        self.dir_filetype_stats[project_file.filetype] += project_file.file_stats
+
+    def remove_file_stats(self, filetype, file_stats):
+        """remove_file_stats(filetype, file_stats)
+           Remove a file from an already classified directory.
+        """
+        dir_filetype_stats = self.dir_filetype_stats[filetype]
+        dir_filetype_stats -= file_stats
+        self.dir_stats -= file_stats
+        if dir_filetype_stats.files == 0:
+            del self.dir_filetype_stats[filetype]
+
+    def release_files(self):
+        """release_files()
+           Drop the ProjectFiles, once they have been added to the file
+           tables of the trees.
+        """
+        self.project_files = []
+        self.registered_files = []
+        self._dirpath = None
 
 #    def _patterns_match(self, names, patterns, name):
 #        if name in names:
@@ -75,116 +159,106 @@ class ProjectDir(object):
 #                return True
 #        return False
 
-    def pre_classify(self):
-        real_dirpath = os.path.realpath(self.dirpath)
-        self.progress_bar = None
-        if not os.path.isdir(real_dirpath):
-            return
-
-        exclude_dir_names = self.project.exclude_dir_names
-        exclude_dir_matchers = self.project.exclude_dir_matchers
-        exclude_file_names = self.project.exclude_file_names
-        exclude_file_matchers = self.project.exclude_file_matchers
-
-        dirnames = []
-        filenames = []
-        try:
-            names = os.listdir(self.dirpath)
-        except OSError as e:
-            names = ()
-            pass
-        for name in names:
-            pathname = os.path.join(self.dirpath, name)
-            realpathname = os.path.realpath(pathname)
-            if os.path.isdir(realpathname):
-                if not patternutils.match_names_or_matchers(exclude_dir_names, exclude_dir_matchers, name):
-                    dirnames.append(pathname)
-            else:
-                if not patternutils.match_names_or_matchers(exclude_file_names, exclude_file_matchers, name):
-                    filenames.append(pathname)
-
-        if self.level < self.project.progress_bar_level:
-            intervals = 2 * len(dirnames) + 3 * len(filenames)
-            if intervals:
-                progress_bar = self.parent_progress_bar.sub_progress_bar(intervals=intervals)
-            else:
-                progress_bar = None
-        else:
-            progress_bar = None
-        self.progress_bar = progress_bar
+    def list_dir(self):
+        # with a ScanCache, a directory whose modification time has not
+        # changed is not listed again: its files are only stat'ed.
+        dirpath = self._dirpath = self.dirpath
+        io_limit = self.project.io_limit
+        listing = None
+        scan_cache = self.project.scan_cache
+        if scan_cache is not None:
+            try:
+                with io_limit:
+                    dir_stat_result = os.stat(dirpath)
+            except OSError:
+                dir_stat_result = None
+            cached_listing = scan_cache.lookup_dir(dirpath, dir_stat_result)
+            if cached_listing is not None:
+                listing = dirscan.stat_dir(dirpath, *cached_listing, io_limit=io_limit)
+        if listing is None:
+            listing = dirscan.scan_dir(dirpath,
+                self.project.exclude_dir_names,
+                self.project.exclude_dir_matchers,
+                self.project.exclude_file_names,
+                self.project.exclude_file_matchers,
+                io_limit=io_limit)
+            if scan_cache is not None:
+                subdirpaths, file_entries = listing
+                scan_cache.store_dir(dirpath, dir_stat_result,
+                    [os.path.basename(subdirpath) for subdirpath in subdirpaths],
+                    [file_entry.filename for file_entry in file_entries])
+        subdirpaths, file_entries = listing
+        for subdirpath in subdirpaths:
+            self._add_dir(subdirpath)
+        for file_entry in file_entries:
+            self._add_file(file_entry)
 
-        if progress_bar:
-            for pathname in dirnames:
-                self._add_dir(pathname)
-                progress_bar.render(basedir=pathname[-10:])
-            for pathname in filenames:
-                self._add_file(pathname)
-                progress_bar.render(basedir=pathname[-10:])
-        else:
-            for pathname in dirnames:
-                self._add_dir(pathname)
-            for pathname in filenames:
-                self._add_file(pathname)
-
-        # pre
-        if progress_bar:
-            for project_file in self.project_files:
-                project_file.pre_classify()
-                if project_file.filetype is not None:
-                    self._register_project_file(project_file)
-                progress_bar.render(basedir=project_file.filepath[-10:])
+    def _init_progress_bar(self):
+        if self.parent:
+            parent_progress_bar = self.parent.progress_bar
+            if parent_progress_bar is not None:
+                parent_progress_bar.render(basedir=self.dirpath[-10:])
         else:
-            for project_file in self.project_files:
-                project_file.pre_classify()
-                if project_file.filetype is not None:
-                    self._register_project_file(project_file)
+            parent_progress_bar = self.project.progress_bar
+        progress_bar = None
+        if self.level < self.project.progress_bar_level and parent_progress_bar is not None:
+            intervals = len(self.project_dirs) + 2 * len(self.project_files)
+            if intervals:
+                progress_bar = parent_progress_bar.sub_progress_bar(intervals=intervals)
+        self.progress_bar = progress_bar
 
+    def classify_files(self):
+        """classify_files()
+           List the directory, classify and count its files and resolve
+           their filetypes; the parent directories must be already
+           classified.
+        """
+        self.list_dir()
+        pre_classified = [project_file.classify() for project_file in self.project_files]
+        self.resolve_classified_files(pre_classified)
 
-    def post_classify(self):
+    def resolve_classified_files(self, pre_classified):
+        """resolve_classified_files(pre_classified)
+           Complete the classification of files that have already been
+           classified by name and by content, and counted, possibly on
+           other threads. 'pre_classified' tells, for each file, if it was
+           classified by ProjectFile.pre_classify. These files are
+           registered first, then the others are resolved by majority vote
+           in order, so that the result does not depend on the order in
+           which the files have been classified.
+        """
+        self._init_progress_bar()
         progress_bar = self.progress_bar
 
-        # post
-        for project_file in self.project_files:
-            must_register = project_file.filetype is None
-            project_file.post_classify()
-            if must_register:
+        for project_file, pre in zip(self.project_files, pre_classified):
+            if pre:
                 self._register_project_file(project_file)
             if progress_bar:
                 progress_bar.render(basedir=project_file.filepath[-10:])
 
-        # dir stats
-        for project_file in self.project_files:
-            self.dir_stats += project_file.file_stats
-            self.dir_filetype_stats[project_file.filetype] += project_file.file_stats
+        for project_file, pre in zip(self.project_files, pre_classified):
+            if not pre:
+                project_file.resolve_filetype()
+                self._register_project_file(project_file)
+            project_file.release()
             if progress_bar:
                 progress_bar.render(basedir=project_file.filepath[-10:])
 
-        for project_dir in self.project_dirs:
-            project_dir.post_classify()
-            if progress_bar:
-                progress_bar.render(basedir=project_dir.dirpath[-10:])
-
-#    def get_tree_stats(self):
-#        tree_filetype_project_files = collections.defaultdict(list)
-#        tree_filetype_stats = collections.defaultdict(TreeStat)
-#        tree_stats = TreeStats()
-#        self._update_tree_stats(
-#            tree_filetype_project_files,
-#            tree_filetype_stats,
-#            tree_stats)
-#        return (tree_filetype_project_files, tree_filetype_stats, tree_stats)
+        self._make_dir_stats()
+
+    def _make_dir_stats(self):
+        for project_file in self.project_files:
+            self.dir_stats += project_file.file_stats
 
     def _update_tree_stats(self,
-                        tree_filetype_project_files,
+                        tree_file_table,
                         tree_filetype_stats,
                         tree_stats):
-        for filetype, project_files in self.dir_filetype_project_files.items():
-            tree_filetype_project_files[filetype].extend(project_files)
-            tree_filetype_stats[filetype] += self.dir_filetype_stats[filetype]
+        if tree_file_table is not None and self.registered_files:
+            dir_id = tree_file_table.project_dir_id(self)
+            for project_file in self.registered_files:
+                tree_file_table.append_project_file(project_file, dir_id)
+        for filetype, dir_filetype_stats in self.dir_filetype_stats.items():
+            tree_filetype_stats[filetype] += dir_filetype_stats
         tree_stats += self.dir_stats
         tree_stats.dirs += 1
-        for project_dir in self.project_dirs:
-            project_dir._update_tree_stats(
-                        tree_filetype_project_files,
-                        tree_filetype_stats,
-                        tree_stats)
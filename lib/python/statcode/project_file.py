@@ -18,26 +18,46 @@
 __author__ = 'Simone Campagna'
 
 import os
+import sys
 import fnmatch
 import collections
 
 from .stats import FileStats
 from .filetype_classifier import FileTypeClassifier
+from .file_reader import FileReader
+from .scan_cache import CacheEntry
 
 class ProjectFile(object):
-    def __init__(self, filepath, project_dir, filetype=None):
+    __slots__ = ('project_dir', 'filename', '_filepath', 'stat_result', '_filetypes', 'qualifiers', 'filetype', 'file_stats')
+    def __init__(self, filepath, project_dir, filetype=None, filename=None, stat_result=None):
         self.project_dir = project_dir
-        self.filetype_classifier = project_dir.project.filetype_classifier
-        self.filepath = filepath
+        # the path is built from the ProjectDir and the file name; the
+        # full path is kept only until the file is released
+        if filename is None:
+            filename = os.path.basename(filepath)
+        self.filename = filename
+        self._filepath = filepath
+        self.stat_result = stat_result
         self._filetypes = None
         self.qualifiers = None
         self.filetype = filetype
         self.file_stats = None
 
-    def pre_classify(self):
-        qualifiers, self._filetypes = self.filetype_classifier.classify(self.filepath)
+    @property
+    def filepath(self):
+        if self._filepath is not None:
+            return self._filepath
+        else:
+            return os.path.join(self.project_dir.dirpath, self.filename)
+
+    @property
+    def filetype_classifier(self):
+        return self.project_dir.project.filetype_classifier
+
+    def pre_classify(self, file_reader=None):
+        qualifiers, self._filetypes = self.filetype_classifier.classify(self.filepath, self.filename, self.stat_result, file_reader=file_reader)
         if qualifiers:
-            self.qualifiers = ";".join(qualifiers) + '-'
+            self.qualifiers = sys.intern(";".join(qualifiers) + '-')
         if self._filetypes is not None:
             if len(self._filetypes) == 0:
                 self.filetype = FileTypeClassifier.FILETYPE_UNCLASSIFIED
@@ -45,64 +65,140 @@ class ProjectFile(object):
                 self.filetype = next(iter(self._filetypes))
         #print("PRE", self.filepath, self._filetypes, self.filetype)
 
-    def post_classify(self):
-#        if self.filepath.endswith(".h"):
-#            print("***", self.filepath, self.filetype, self._filetypes)
+    def classify(self):
+        """classify() -> pre_classified
+           Classify the file by name and by content, and count it; the
+           filetype can still be None if the content classification is
+           ambiguous, see resolve_filetype. This does not depend on any
+           other file, so it can run on any thread.
+           The file is opened at most once: the shebang, the content
+           classification and the line count share the same FileReader.
+           If the project has a ScanCache, unchanged files are not opened.
+        """
+        pre_classified = self.lookup_cache()
+        if pre_classified is not None:
+            return pre_classified
+        project = self.project_dir.project
+        with FileReader(self.filepath, project.block_size, project.io_limit) as file_reader:
+            self.pre_classify(file_reader)
+            pre_classified = self.filetype is not None
+            self.classify_by_content(file_reader)
+            self.make_file_stats(file_reader)
+        self.store_cache(pre_classified)
+        return pre_classified
+
+    def lookup_cache(self):
+        """lookup_cache() -> pre_classified, or None
+           If the project has a ScanCache with a valid entry for the file,
+           take the classification and the stats from it.
+        """
+        scan_cache = self.project_dir.project.scan_cache
+        if scan_cache is not None:
+            cache_entry = scan_cache.lookup(self.filepath, self.stat_result)
+            if cache_entry is not None:
+                self.filetype = cache_entry.filetype
+                self._filetypes = cache_entry.filetypes
+                self.qualifiers = cache_entry.qualifiers
+                self.file_stats = FileStats(lines=cache_entry.lines, bytes=cache_entry.bytes, uncounted=cache_entry.uncounted)
+                return cache_entry.pre_classified
+        return None
+
+    def store_cache(self, pre_classified):
+        """store_cache(pre_classified)
+           Store the classification and the stats in the project ScanCache.
+        """
+        scan_cache = self.project_dir.project.scan_cache
+        if scan_cache is not None and not self.filetype in FileTypeClassifier.NON_EXISTENT_FILES:
+            file_stats = self.file_stats
+            scan_cache.store(self.filepath, self.stat_result, CacheEntry(
+                filetype=self.filetype,
+                filetypes=self._filetypes,
+                qualifiers=self.qualifiers,
+                lines=file_stats.lines,
+                bytes=file_stats.bytes,
+                uncounted=file_stats.uncounted,
+                pre_classified=pre_classified))
+
+    def classify_by_content(self, file_reader=None):
+        if self.filetype is None and self._filetypes:
+            self._filetypes = self.filetype_classifier.classify_by_content(self._filetypes, self.filepath, file_reader=file_reader)
+            if len(self._filetypes) == 0:
+                self.filetype = FileTypeClassifier.FILETYPE_UNCLASSIFIED
+            elif len(self._filetypes) == 1:
+                self.filetype = next(iter(self._filetypes))
+
+    def release(self):
+        """release()
+           Drop the data that are only needed to classify the file.
+        """
+        self._filetypes = None
+        self.stat_result = None
+        self._filepath = None
+
+    def resolve_filetype(self):
         if self.filetype is None:
             if not self._filetypes:
                 self.filetype = FileTypeClassifier.FILETYPE_UNCLASSIFIED
             else:
-                self._filetypes = self.filetype_classifier.classify_by_content(self._filetypes, self.filepath)
-                if len(self._filetypes) == 0:
-                    self.filetype = FileTypeClassifier.FILETYPE_UNCLASSIFIED
-                elif len(self._filetypes) == 1:
-                    self.filetype = next(iter(self._filetypes))
-                else:
-                    project_dir = self.project_dir
-                    while project_dir:
-                        for filetype in project_dir.most_common_filetypes():
-                            assert not filetype in FileTypeClassifier.NO_FILETYPE_FILES
-                            if filetype in self._filetypes:
-                                self.filetype = filetype
-                                #print("HERE A: ", self.filepath, self._filetypes, self.filetype, project_dir.dirpath)
-                                break
-                        else:
-                            project_dir = project_dir.parent
-                            continue
-                        break
+                project_dir = self.project_dir
+                while project_dir:
+                    for filetype in project_dir.most_common_filetypes():
+                        assert not filetype in FileTypeClassifier.NO_FILETYPE_FILES
+                        if filetype in self._filetypes:
+                            self.filetype = filetype
+                            #print("HERE A: ", self.filepath, self._filetypes, self.filetype, project_dir.dirpath)
+                            break
                     else:
-                        #self.filetype = next(iter(self._filetypes))
-                        self.filetype = next(iter(self._filetypes))
-                        #print("HERE Z: ", self.filepath, self._filetypes, self.filetype)
+                        project_dir = project_dir.parent
+                        continue
+                    break
+                else:
+                    #self.filetype = next(iter(self._filetypes))
+                    self.filetype = next(iter(self._filetypes))
+                    #print("HERE Z: ", self.filepath, self._filetypes, self.filetype)
+
+    def _is_stat_only(self):
+        # binary files, and files bigger than stat_only_size, can be
+        # measured without reading them; their lines are not counted.
+        configuration = self.project_dir.project.configuration
+        if not (configuration.stat_only_binary or configuration.stat_only_size > 0):
+            return False
+        if self.stat_result is None:
+            try:
+                with self.project_dir.project.io_limit:
+                    self.stat_result = os.stat(self.filepath)
+            except OSError:
+                return False
+        if configuration.stat_only_binary and self.filetype_classifier.filetype_is_binary(self.filetype):
+            return True
+        if 0 < configuration.stat_only_size < self.stat_result.st_size:
+            return True
+        return False
 
-        # stats
+    def make_file_stats(self, file_reader=None):
         if self.filetype in FileTypeClassifier.NON_EXISTENT_FILES:
             self.file_stats = FileStats()
+        elif self._is_stat_only():
+            self.file_stats = FileStats(bytes=self.stat_result.st_size, uncounted=1)
         else:
-            block_size = self.project_dir.project.block_size
-            num_lines = 0
-            num_bytes = 0
-            newline = b'\n'
+            if file_reader is None:
+                project = self.project_dir.project
+                file_reader = FileReader(self.filepath, project.block_size, project.io_limit)
             try:
-                with open(self.filepath, 'rb') as filehandle:
-                    last_block = None
-                    while True:
-                        block = filehandle.read(block_size)
-                        if not block:
-                            break
-                        last_block = block
-                        num_bytes += len(block)
-                        num_lines += block.count(newline)
-                    if last_block and last_block[-1] != newline:
-                        num_lines += 1
+                with file_reader:
+                    num_lines, num_bytes = file_reader.count_lines()
                     self.file_stats = FileStats(lines=num_lines, bytes=num_bytes)
             except (OSError, IOError) as e:
                 self.filetype = FileTypeClassifier.FILETYPE_UNREADABLE
                 self.file_stats = FileStats()
-                try:
-                    self.file_stats.bytes += os.stat(self.filepath).st_size
-                except:
-                    pass
+                if self.stat_result is not None:
+                    self.file_stats.bytes += self.stat_result.st_size
+                else:
+                    try:
+                        with self.project_dir.project.io_limit:
+                            self.file_stats.bytes += os.stat(self.filepath).st_size
+                    except:
+                        pass
             #if self.filetype_classifier.filetype_is_binary(self.filetype):
             #    self.file_stats = FileStats(bytes=os.stat(self.filepath).st_size)
             #else:
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import concurrent.futures
+
+from .project_configuration import ProjectConfiguration
+from .project_tree import ProjectTree, BaseTree
+from .scan_cache import ScanCache
+from .file_reader import NO_IO_LIMIT
+
+class ShardTree(BaseTree):
+    """ShardTree(project_tree)
+       The partial result of a shard: per-filetype TreeStats and the
+       FileTable; it can be merged with BaseTree.merge_tree.
+    """
+    def __init__(self, project_tree):
+        super().__init__()
+        self.cache_updates = None
+        self.filename_cache_counters = (0, 0)
+        self.merge_tree(project_tree)
+
+class ShardParentDir(object):
+    """ShardParentDir(level, most_common_filetypes, parent)
+       Stands for a parent directory that has been classified in another
+       process; it only provides what the majority vote needs.
+    """
+    progress_bar = None
+    def __init__(self, level, most_common_filetypes, parent):
+        self.level = level
+        self._most_common_filetypes = most_common_filetypes
+        self.parent = parent
+
+    def most_common_filetypes(self):
+        return iter(self._most_common_filetypes)
+
+class ShardProject(object):
+    """ShardProject(configuration, filetype_hints, block_size, scan_cache=None, aggregate_only=False)
+       The worker side of a project: it provides to the ProjectDirs of a
+       shard what a Project provides, without scanning anything itself.
+    """
+    progress_bar = None
+    progress_bar_level = 0
+    jobs = None
+    async_ops = None
+    pipeline_workers = None
+    io_limit = NO_IO_LIMIT
+    def __init__(self, configuration, filetype_hints, block_size, scan_cache=None, aggregate_only=False):
+        self.configuration = configuration
+        self.filetype_classifier = configuration.filetype_classifier
+        self.exclude_dir_names = configuration.exclude_dir_names
+        self.exclude_dir_matchers = configuration.exclude_dir_matchers
+        self.exclude_file_names = configuration.exclude_file_names
+        self.exclude_file_matchers = configuration.exclude_file_matchers
+        self._filetype_hints = filetype_hints
+        self.block_size = block_size
+        self.scan_cache = scan_cache
+        self.aggregate_only = aggregate_only
+
+    def filetype_hints(self):
+        return iter(self._filetype_hints)
+
+    def scan_shard(self, dirpath, filetype, parent_filetypes):
+        parent = None
+        for level, most_common_filetypes in enumerate(reversed(parent_filetypes)):
+            parent = ShardParentDir(level, most_common_filetypes, parent)
+        if self.scan_cache is not None:
+            self.scan_cache.load(dirpath)
+        filename_cache = self.filetype_classifier.filename_cache
+        hits, misses = filename_cache.hits, filename_cache.misses
+        shard_tree = ShardTree(ProjectTree(dirpath, parent, self, filetype=filetype))
+        if self.scan_cache is not None:
+            shard_tree.cache_updates = self.scan_cache.pop_updates()
+        shard_tree.filename_cache_counters = (filename_cache.hits - hits, filename_cache.misses - misses)
+        return shard_tree
+
+_SHARD_PROJECT = None
+
+def _init_shard_worker(config, compiled_dir, filetype_hints, block_size, scan_cache_args, aggregate_only):
+    # the FileTypeClassifier is built once per worker process
+    global _SHARD_PROJECT
+    if scan_cache_args is not None:
+        scan_cache = ScanCache(*scan_cache_args)
+    else:
+        scan_cache = None
+    _SHARD_PROJECT = ShardProject(ProjectConfiguration(config, compiled_dir), filetype_hints, block_size, scan_cache, aggregate_only)
+
+def _scan_shard(dirpath, filetype, parent_filetypes):
+    return _SHARD_PROJECT.scan_shard(dirpath, filetype, parent_filetypes)
+
+class ShardedProjectTree(ProjectTree):
+    """ShardedProjectTree(dirpath, parent, project, filetype=None)
+       A ProjectTree whose subtrees are scanned by a pool of
+       project.processes worker processes.
+    """
+    SHARDS_PER_PROCESS = 4
+    def classify(self):
+        self.file_table.clear()
+        self.tree_filetype_stats.clear()
+        self.tree_stats.clear()
+        processes = self.project.processes
+        configuration = self.project.configuration
+        scan_cache = self.project.scan_cache
+        if scan_cache is not None:
+            scan_cache_args = (scan_cache.filename, scan_cache.config_key)
+        else:
+            scan_cache_args = None
+
+        # the top directories are classified here, level by level, until
+        # there are enough subdirectories to feed the workers; since all
+        # their parents are complete, the subdirectories can be sent to
+        # the workers along with the parents' most common filetypes.
+        max_shards = processes * self.SHARDS_PER_PROCESS
+        shard_dirs = [self]
+        while shard_dirs and len(shard_dirs) < max_shards:
+            sub_project_dirs = []
+            for project_dir in shard_dirs:
+                project_dir.classify_files()
+                sub_project_dirs.extend(project_dir.project_dirs)
+            shard_dirs = sub_project_dirs
+
+        shard_trees = {}
+        if shard_dirs:
+            with concurrent.futures.ProcessPoolExecutor(
+                        max_workers=processes,
+                        initializer=_init_shard_worker,
+                        initargs=(configuration.config, configuration.compiled_dir, tuple(self.project.filetype_hints()), self.project.block_size, scan_cache_args,
+                                  self.project.aggregate_only)) as executor:
+                futures = {}
+                for project_dir in shard_dirs:
+                    parent_filetypes = []
+                    parent = project_dir.parent
+                    while parent is not None:
+                        parent_filetypes.append(list(parent.most_common_filetypes()))
+                        parent = parent.parent
+                    futures[project_dir] = executor.submit(_scan_shard, project_dir.dirpath, project_dir.filetype, parent_filetypes)
+                filename_cache = self.project.filetype_classifier.filename_cache
+                for project_dir, future in futures.items():
+                    shard_tree = future.result()
+                    if scan_cache is not None:
+                        scan_cache.merge_updates(shard_tree.cache_updates)
+                    hits, misses = shard_tree.filename_cache_counters
+                    filename_cache.hits += hits
+                    filename_cache.misses += misses
+                    shard_trees[project_dir] = shard_tree
+
+        # merge in preorder, as the serial scan does
+        file_table = self._tree_file_table()
+        for project_dir in self.walk(detach=self.project.aggregate_only):
+            if project_dir in shard_trees:
+                self.merge_tree(shard_trees.pop(project_dir))
+            else:
+                project_dir._update_tree_stats(
+                    file_table,
+                    self.tree_filetype_stats,
+                    self.tree_stats
+                )
+                project_dir.release_files()
+
+def scan_projects(configuration, project_dirs, processes, filetype_hints=(), block_size=None, scan_cache=None, aggregate_only=False):
+    """scan_projects(configuration, project_dirs, processes, ...) -> iterator over (project_dir, ShardTree)
+       Scan whole projects concurrently, each one as a single shard, on a
+       pool of 'processes' worker processes. The trees are yielded in the
+       order of 'project_dirs', each one as soon as it and all the
+       previous ones are complete, so that the merged results do not
+       depend on the order in which the scans finish.
+    """
+    if block_size is None:
+        block_size = 1024 * 1024
+    if scan_cache is not None:
+        scan_cache_args = (scan_cache.filename, scan_cache.config_key)
+    else:
+        scan_cache_args = None
+    filename_cache = configuration.filetype_classifier.filename_cache
+    with concurrent.futures.ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_shard_worker,
+                initargs=(configuration.config, configuration.compiled_dir, tuple(filetype_hints), block_size, scan_cache_args, aggregate_only)) as executor:
+        futures = [(project_dir, executor.submit(_scan_shard, project_dir, None, [])) for project_dir in project_dirs]
+        for project_dir, future in futures:
+            shard_tree = future.result()
+            if scan_cache is not None:
+                # the entries are loaded to delete those of removed files
+                scan_cache.load(project_dir)
+                scan_cache.merge_updates(shard_tree.cache_updates)
+                scan_cache.save(project_dir)
+            hits, misses = shard_tree.filename_cache_counters
+            filename_cache.hits += hits
+            filename_cache.misses += misses
+            yield project_dir, shard_tree
@@ -19,40 +19,223 @@ __author__ = 'Simone Campagna'
 
 import os
 import fnmatch
+import asyncio
 import collections
+import concurrent.futures
 
 from .project_dir import ProjectDir
+from .file_table import FileTable
+from .scan_pipeline import ScanPipeline
 from .stats import DirStats, TreeStats
 
 class BaseTree(object):
     def __init__(self):
-        self.tree_filetype_project_files = collections.defaultdict(list)
+        self.file_table = FileTable()
         self.tree_filetype_stats = collections.defaultdict(TreeStats)
         self.tree_stats = TreeStats()
 
     def merge_tree(self, tree):
-        for filetype, project_files in tree.tree_filetype_project_files.items():
-            self.tree_filetype_project_files[filetype].extend(project_files)
-            self.tree_filetype_stats[filetype] += tree.tree_filetype_stats[filetype]
+        self.file_table.extend(tree.file_table)
+        for filetype, tree_filetype_stats in tree.tree_filetype_stats.items():
+            self.tree_filetype_stats[filetype] += tree_filetype_stats
         self.tree_stats += tree.tree_stats
 
+    def add_project_files(self, project_files):
+        for project_file in project_files:
+            filetype = project_file.filetype
+            self.file_table.append_project_file(project_file)
+            self.tree_filetype_stats[filetype] += project_file.file_stats
+            self.tree_stats += project_file.file_stats
+
+    def _remove_file_rows(self, file_rows):
+        for file_row in file_rows:
+            filetype = file_row.filetype
+            tree_filetype_stats = self.tree_filetype_stats[filetype]
+            tree_filetype_stats -= file_row.file_stats
+            self.tree_stats -= file_row.file_stats
+            if tree_filetype_stats.files == 0:
+                del self.tree_filetype_stats[filetype]
+
+    def remove_files(self, project_dir, filenames):
+        """remove_files(project_dir, filenames)
+           Remove the files 'filenames' of 'project_dir' from the tree.
+        """
+        self._remove_file_rows(self.file_table.remove_files(project_dir, filenames))
+
+    def add_project_dirs(self, project_dirs):
+        """add_project_dirs(project_dirs)
+           Add classified ProjectDirs (not their subdirectories) to the tree.
+        """
+        for project_dir in project_dirs:
+            project_dir._update_tree_stats(
+                self.file_table,
+                self.tree_filetype_stats,
+                self.tree_stats
+            )
+
+    def remove_project_dirs(self, project_dirs):
+        """remove_project_dirs(project_dirs)
+           Remove ProjectDirs (not their subdirectories) from the tree.
+        """
+        self._remove_file_rows(self.file_table.remove_dirs(project_dirs))
+        self.tree_stats.dirs -= len(project_dirs)
+
 class ProjectTree(ProjectDir, BaseTree):
+    # the stages of the last pipeline scan, see ScanPipeline
+    pipeline_stages = ()
+    # the work started in advance by the parallel scans, per worker
+    LOOKAHEAD_DIRS = 4
+    LOOKAHEAD_FILES = 64
     def __init__(self, dirpath, parent, project, filetype=None):
         BaseTree.__init__(self)
         super().__init__(dirpath, parent=parent, project=project, filetype=filetype)
-        self.post_classify()
-        self.make_tree_stats()
+        self.classify()
+
+    def classify(self):
+        self.file_table.clear()
+        self.tree_filetype_stats.clear()
+        self.tree_stats.clear()
+        jobs = self.project.jobs
+        async_ops = self.project.async_ops
+        pipeline_workers = self.project.pipeline_workers
+        if pipeline_workers is not None:
+            self._classify_pipeline(pipeline_workers)
+        elif async_ops is not None and async_ops > 0:
+            asyncio.run(self._classify_async(async_ops))
+        elif jobs is not None and jobs > 1:
+            self._classify_parallel(jobs)
+        else:
+            self._classify_serial()
+
+    def _tree_file_table(self):
+        # in aggregate-only mode the files are only counted
+        if self.project.aggregate_only:
+            return None
+        else:
+            return self.file_table
+
+    def _classify_serial(self):
+        # A file's filetype can be resolved looking at the most common
+        # filetypes of its directory and of its parents only; visiting
+        # the tree in preorder, each directory can be completely classified
+        # before its subdirectories are listed, and added to the tree stats.
+        file_table = self._tree_file_table()
+        for project_dir in self.walk(detach=self.project.aggregate_only):
+            project_dir.classify_files()
+            project_dir._update_tree_stats(
+                file_table,
+                self.tree_filetype_stats,
+                self.tree_stats
+            )
+            project_dir.release_files()
+
+    def _classify_parallel(self, jobs):
+        # Directory listing and the per-file work (classification by name
+        # and by content, line counting) run on the thread pool; only the
+        # majority vote, which depends on the parent directories, runs
+        # here, in preorder like _classify_serial. The work is submitted
+        # lazily: the next LOOKAHEAD_DIRS directories per job are listed
+        # in advance, and at most LOOKAHEAD_FILES files per job are pending,
+        # so that memory does not grow with the size of the tree.
+        detach = self.project.aggregate_only
+        file_table = self._tree_file_table()
+        max_pending_files = jobs * self.LOOKAHEAD_FILES
+        pending_dirs = collections.deque()
+        pending_files = 0
+
+        def resolve_dir():
+            project_dir, file_futures = pending_dirs.popleft()
+            project_dir.resolve_classified_files([future.result() for future in file_futures])
+            project_dir._update_tree_stats(
+                file_table,
+                self.tree_filetype_stats,
+                self.tree_stats
+            )
+            project_dir.release_files()
+            if detach:
+                project_dir.project_dirs = []
+            return len(file_futures)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            start_listing = lambda project_dir: executor.submit(project_dir.list_dir)
+            for project_dir, dir_future in self.walk_ahead(start_listing, jobs * self.LOOKAHEAD_DIRS):
+                # the pending directories have already been walked, so they
+                # can be detached once resolved
+                while pending_files > max_pending_files:
+                    pending_files -= resolve_dir()
+                dir_future.result()
+                file_futures = [executor.submit(project_file.classify) for project_file in project_dir.project_files]
+                pending_dirs.append((project_dir, file_futures))
+                pending_files += len(file_futures)
+            while pending_dirs:
+                resolve_dir()
+
+    def _classify_pipeline(self, pipeline_workers):
+        # each stage runs on its own threads, see ScanPipeline; the
+        # directories come out of the pipeline in preorder.
+        scan_pipeline = ScanPipeline(self, pipeline_workers)
+        file_table = self._tree_file_table()
+        for project_dir in scan_pipeline.run(detach=self.project.aggregate_only):
+            project_dir._update_tree_stats(
+                file_table,
+                self.tree_filetype_stats,
+                self.tree_stats
+            )
+            project_dir.release_files()
+        self.pipeline_stages = scan_pipeline.stages
+
+    async def _classify_async(self, async_ops):
+        # As _classify_parallel, but the directory listings and the per-file
+        # work are tasks of the event loop, run on the executor, and the
+        # majority vote runs on the event loop, in preorder. What is
+        # limited is not the number of tasks but the filesystem calls
+        # themselves (stat, listing, open and read, see Project.io_limit):
+        # at most async_ops are in flight, while the other threads of the
+        # executor process the data already read, so that on high latency
+        # filesystems the round trips overlap without waiting for the
+        # classification of the files.
+        loop = asyncio.get_running_loop()
+        detach = self.project.aggregate_only
+        file_table = self._tree_file_table()
+        max_pending_files = async_ops * self.LOOKAHEAD_FILES
+        pending_dirs = collections.deque()
+        pending_files = 0
+
+        def run(function):
+            return loop.run_in_executor(executor, function)
+
+        async def resolve_dir():
+            project_dir, file_tasks = pending_dirs.popleft()
+            project_dir.resolve_classified_files(await asyncio.gather(*file_tasks))
+            project_dir._update_tree_stats(
+                file_table,
+                self.tree_filetype_stats,
+                self.tree_stats
+            )
+            project_dir.release_files()
+            if detach:
+                project_dir.project_dirs = []
+            return len(file_tasks)
 
-#    def post_classify(self):
-#        super().post_classify()
-#        self.make_tree_stats()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=async_ops + (os.cpu_count() or 1)) as executor:
+            start_listing = lambda project_dir: run(project_dir.list_dir)
+            for project_dir, dir_task in self.walk_ahead(start_listing, async_ops * self.LOOKAHEAD_DIRS):
+                while pending_files > max_pending_files:
+                    pending_files -= await resolve_dir()
+                await dir_task
+                file_tasks = [run(project_file.classify) for project_file in project_dir.project_files]
+                pending_dirs.append((project_dir, file_tasks))
+                pending_files += len(file_tasks)
+            while pending_dirs:
+                await resolve_dir()
 
     def make_tree_stats(self):
-        self.tree_filetype_project_files.clear()
+        # the files are kept only in the file table, which is not rebuilt;
+        # in aggregate-only mode the subdirectories are not kept either.
         self.tree_filetype_stats.clear()
         self.tree_stats.clear()
-        self._update_tree_stats(
-            self.tree_filetype_project_files,
-            self.tree_filetype_stats,
-            self.tree_stats
-        )
+        for project_dir in self.walk():
+            for filetype, dir_filetype_stats in project_dir.dir_filetype_stats.items():
+                self.tree_filetype_stats[filetype] += dir_filetype_stats
+            self.tree_stats += project_dir.dir_stats
+            self.tree_stats.dirs += 1
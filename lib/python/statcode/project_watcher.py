@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import time
+import collections
+
+from .project_file import ProjectFile
+from . import inotify
+from . import patternutils
+
+class ProjectWatcher(object):
+    """ProjectWatcher(projects, trees=())
+       Keep the statistics of already scanned projects up to date, using
+       inotify: only the files and directories named by the events are
+       classified again, and their ProjectDir, ProjectTree and Project
+       aggregates (and those of 'trees', for instance a MetaProject
+       containing the projects) are updated.
+       The majority vote is applied to new and changed files only, so
+       that the other files keep their filetype; a cold scan could
+       classify some ambiguous files differently.
+       Projects scanned with processes, or in aggregate-only mode, cannot
+       be watched.
+    """
+    MASK = inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO
+    def __init__(self, projects, trees=()):
+        self.projects = list(projects)
+        self.trees = list(trees)
+        self.inotify = inotify.Inotify()
+        self._wd_project_dirs = collections.defaultdict(list)
+        self._project_dir_wds = {}
+        for project in self.projects:
+            if project.processes is not None and project.processes > 1:
+                raise ValueError("invalid project {!r}: projects scanned with processes cannot be watched".format(project.name))
+            if project.aggregate_only:
+                raise ValueError("invalid project {!r}: aggregate-only projects cannot be watched".format(project.name))
+            self._watch_project(project)
+
+    def close(self):
+        self.inotify.close()
+
+    def _project_trees(self, project):
+        return [project.project_tree, project] + self.trees
+
+    def _watch_project(self, project):
+        for project_dir in project.project_tree.walk():
+            project_dir.progress_bar = None
+            self._add_watch(project_dir)
+
+    def _add_watch(self, project_dir):
+        try:
+            wd = self.inotify.add_watch(project_dir.dirpath, self.MASK | inotify.IN_ONLYDIR)
+        except OSError:
+            return
+        self._wd_project_dirs[wd].append(project_dir)
+        self._project_dir_wds[project_dir] = wd
+
+    def _rm_watch(self, project_dir):
+        wd = self._project_dir_wds.pop(project_dir, None)
+        if wd is None:
+            return
+        project_dirs = self._wd_project_dirs[wd]
+        project_dirs.remove(project_dir)
+        if not project_dirs:
+            del self._wd_project_dirs[wd]
+            try:
+                self.inotify.rm_watch(wd)
+            except OSError:
+                # already removed by the kernel
+                pass
+
+    def wait(self, interval):
+        """wait(interval) -> changed
+           Wait for events, collect them for 'interval' seconds, and
+           apply them; return True if the statistics have changed.
+        """
+        events = self.inotify.read_events()
+        deadline = time.monotonic() + interval
+        while True:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            events.extend(self.inotify.read_events(timeout=timeout))
+        return self.update(events)
+
+    def update(self, events):
+        """update(events) -> changed
+           Apply inotify events; the events for the same name are merged,
+           and the name is looked up again.
+        """
+        changed_names = collections.OrderedDict()
+        for wd, mask, cookie, name in events:
+            if mask & inotify.IN_Q_OVERFLOW:
+                self.rescan()
+                return True
+            if not name:
+                continue
+            for project_dir in self._wd_project_dirs.get(wd, ()):
+                changed_names.setdefault(project_dir, set()).add(name)
+        changed = False
+        for project_dir, names in changed_names.items():
+            # the directory could have been removed by a previous update
+            if project_dir in self._project_dir_wds:
+                for name in sorted(names):
+                    self._update_name(project_dir, name)
+                    changed = True
+        return changed
+
+    def rescan(self):
+        """rescan()
+           Scan all the projects again.
+        """
+        for project_dir in list(self._project_dir_wds):
+            self._rm_watch(project_dir)
+        for project in self.projects:
+            old_project_dirs = list(project.project_tree.walk())
+            for tree in self._project_trees(project)[1:]:
+                tree.remove_project_dirs(old_project_dirs)
+            project.classify()
+            for tree in self.trees:
+                tree.merge_tree(project.project_tree)
+            self._watch_project(project)
+
+    def _update_name(self, project_dir, name):
+        project = project_dir.project
+        path = os.path.join(project_dir.dirpath, name)
+        file_table = project.project_tree.file_table
+        index = file_table.find(project_dir, name)
+        if index is not None:
+            self._remove_file(project_dir, file_table.row(index))
+        for sub_project_dir in project_dir.project_dirs:
+            if sub_project_dir.name == name:
+                self._remove_dir(project_dir, sub_project_dir)
+                break
+        if os.path.isdir(path):
+            if not patternutils.match_names_or_matchers(project.exclude_dir_names, project.exclude_dir_matchers, name):
+                self._add_dir(project_dir, path)
+        elif os.path.lexists(path):
+            if not patternutils.match_names_or_matchers(project.exclude_file_names, project.exclude_file_matchers, name):
+                self._add_file(project_dir, path, name)
+
+    def _add_file(self, project_dir, filepath, filename):
+        try:
+            stat_result = os.stat(filepath)
+        except OSError:
+            stat_result = None
+        project_file = ProjectFile(filepath, project_dir, filetype=project_dir.filetype, filename=filename, stat_result=stat_result)
+        if not project_file.classify():
+            project_file.resolve_filetype()
+        project_file.release()
+        project_dir.add_project_file(project_file)
+        for tree in self._project_trees(project_dir.project):
+            tree.add_project_files([project_file])
+
+    def _remove_file(self, project_dir, file_row):
+        project_dir.remove_file_stats(file_row.filetype, file_row.file_stats)
+        filename = file_row.filename
+        for tree in self._project_trees(project_dir.project):
+            tree.remove_files(project_dir, [filename])
+
+    def _add_dir(self, project_dir, dirpath):
+        project_dir._add_dir(dirpath)
+        new_project_dirs = []
+        for sub_project_dir in project_dir.project_dirs[-1].walk():
+            # the watch is added before listing, so that no file is lost
+            self._add_watch(sub_project_dir)
+            sub_project_dir.classify_files()
+            new_project_dirs.append(sub_project_dir)
+        for tree in self._project_trees(project_dir.project):
+            tree.add_project_dirs(new_project_dirs)
+        for new_project_dir in new_project_dirs:
+            new_project_dir.release_files()
+
+    def _remove_dir(self, project_dir, sub_project_dir):
+        project_dir.project_dirs.remove(sub_project_dir)
+        old_project_dirs = list(sub_project_dir.walk())
+        for old_project_dir in old_project_dirs:
+            self._rm_watch(old_project_dir)
+        for tree in self._project_trees(project_dir.project):
+            tree.remove_project_dirs(old_project_dirs)
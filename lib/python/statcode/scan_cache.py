@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import sys
+import time
+import sqlite3
+import collections
+
+CacheEntry = collections.namedtuple('CacheEntry', ('filetype', 'filetypes', 'qualifiers', 'lines', 'bytes', 'uncounted', 'pre_classified'))
+
+FILETYPES_SEPARATOR = '\n'
+NAMES_SEPARATOR = b'/'
+
+def default_cache_dir():
+    """default_cache_dir() -> the default directory of the statcode caches"""
+    cache_home = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache_home, 'statcode')
+
+def default_cache_filename():
+    """default_cache_filename() -> the default cache file name"""
+    return os.path.join(default_cache_dir(), 'cache.sqlite')
+
+def _stat_key(stat_result):
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+def _dir_stat_key(stat_result):
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_mtime_ns)
+
+class ScanCache(object):
+    """ScanCache(filename, config_key)
+       A persistent cache of the per-file results of the classification
+       (before the majority vote) and of the counting, stored in a SQLite
+       database. An entry is valid only if the file has the same path,
+       device, inode, size and modification time; the whole cache is
+       dropped if 'config_key' (see ProjectConfiguration.config_key)
+       changes.
+       The listing of directories is cached too, keyed by path, device,
+       inode and modification time, so that unchanged directories are not
+       listed again (see ProjectDir.list_dir).
+       The entries of a project are loaded in memory before scanning it
+       (load), looked up and stored from any thread, and written back
+       at the end (save); the database is never accessed while scanning.
+       The paths looked up are recorded, so that the entries of removed
+       files and directories can be deleted when saving.
+       Paths and names are stored as bytes (see os.fsencode), since they
+       need not be valid UTF-8.
+    """
+    VERSION = '3'
+    # files modified less than RACY_NS nanoseconds before the cache has
+    # been created are not stored, since they could change again without
+    # changing their modification time.
+    RACY_NS = 1000000000
+    def __init__(self, filename, config_key):
+        self.filename = filename
+        self.config_key = config_key
+        self._entries = {}
+        self._updates = {}
+        self._dir_entries = {}
+        self._dir_updates = {}
+        self._seen_dirpaths = set()
+        self._seen_filepaths = set()
+        self._racy_mtime_ns = time.time_ns() - self.RACY_NS
+        self.hits = 0
+        self.misses = 0
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        connection = self._connect()
+        try:
+            with connection:
+                self._init_db(connection)
+        finally:
+            connection.close()
+
+    def _init_db(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)")
+        metadata = dict(connection.execute("SELECT key, value FROM metadata"))
+        if metadata.get('version') != self.VERSION or metadata.get('config_key') != self.config_key:
+            self._clear(connection)
+            connection.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)",
+                (('version', self.VERSION), ('config_key', self.config_key)))
+        connection.execute("""CREATE TABLE IF NOT EXISTS files (
+                                path BLOB PRIMARY KEY,
+                                st_dev INTEGER, st_ino INTEGER, st_size INTEGER, st_mtime_ns INTEGER,
+                                filetype TEXT, filetypes TEXT, qualifiers TEXT,
+                                lines INTEGER, bytes INTEGER, uncounted INTEGER,
+                                pre_classified INTEGER)""")
+        connection.execute("""CREATE TABLE IF NOT EXISTS dirs (
+                                path BLOB PRIMARY KEY,
+                                st_dev INTEGER, st_ino INTEGER, st_mtime_ns INTEGER,
+                                dirnames BLOB, filenames BLOB)""")
+
+    def _connect(self):
+        return sqlite3.connect(self.filename)
+
+    def _clear(self, connection):
+        connection.execute("DROP TABLE IF EXISTS files")
+        connection.execute("DROP TABLE IF EXISTS dirs")
+
+    def _path_range(self, dirpath):
+        # all the paths under dirpath/ are between dirpath/ and dirpath0
+        dirpath = dirpath.rstrip(os.sep)
+        return dirpath + os.sep, dirpath + chr(ord(os.sep) + 1)
+
+    def load(self, dirpath):
+        """load(dirpath)
+           Load the entries of all the files and directories under 'dirpath'.
+        """
+        connection = self._connect()
+        try:
+            path_range = tuple(os.fsencode(path) for path in self._path_range(dirpath))
+            for row in connection.execute("SELECT * FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (os.fsencode(dirpath), ) + path_range):
+                path = os.fsdecode(row[0])
+                stat_key = row[1:4]
+                dirnames, filenames = ([os.fsdecode(name) for name in names.split(NAMES_SEPARATOR)] if names else [] for names in row[4:])
+                self._dir_entries[path] = (stat_key, dirnames, filenames)
+            for row in connection.execute("SELECT * FROM files WHERE path >= ? AND path < ?", path_range):
+                path = os.fsdecode(row[0])
+                stat_key = row[1:5]
+                filetype, filetypes, qualifiers, lines, bytes, uncounted, pre_classified = row[5:]
+                if filetype is not None:
+                    filetype = sys.intern(filetype)
+                if qualifiers is not None:
+                    qualifiers = sys.intern(qualifiers)
+                if filetypes is not None:
+                    filetypes = set(sys.intern(ft) for ft in filetypes.split(FILETYPES_SEPARATOR)) if filetypes else set()
+                self._entries[path] = (stat_key, CacheEntry(filetype, filetypes, qualifiers, lines, bytes, uncounted, bool(pre_classified)))
+        finally:
+            connection.close()
+
+    def lookup(self, filepath, stat_result):
+        """lookup(filepath, stat_result) -> CacheEntry or None"""
+        self._seen_filepaths.add(filepath)
+        if stat_result is None:
+            return None
+        item = self._entries.get(filepath, None)
+        if item is not None and item[0] == _stat_key(stat_result):
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        return None
+
+    def store(self, filepath, stat_result, cache_entry):
+        """store(filepath, stat_result, cache_entry)"""
+        if stat_result is None or stat_result.st_mtime_ns >= self._racy_mtime_ns:
+            return
+        self._updates[filepath] = (_stat_key(stat_result), cache_entry)
+
+    def lookup_dir(self, dirpath, stat_result):
+        """lookup_dir(dirpath, stat_result) -> (dirnames, filenames) or None"""
+        self._seen_dirpaths.add(dirpath)
+        if stat_result is None:
+            return None
+        item = self._dir_entries.get(dirpath, None)
+        if item is not None and item[0] == _dir_stat_key(stat_result):
+            return item[1:]
+        return None
+
+    def store_dir(self, dirpath, stat_result, dirnames, filenames):
+        """store_dir(dirpath, stat_result, dirnames, filenames)"""
+        if stat_result is None or stat_result.st_mtime_ns >= self._racy_mtime_ns:
+            return
+        self._dir_updates[dirpath] = (_dir_stat_key(stat_result), dirnames, filenames)
+
+    def pop_updates(self):
+        """pop_updates() -> updates
+           Return the stored entries that have not been saved yet and the
+           lookup counters, and reset them; see merge_updates.
+        """
+        updates = (self._updates, self._dir_updates, self._seen_dirpaths, self._seen_filepaths, self.hits, self.misses)
+        self._updates = {}
+        self._dir_updates = {}
+        self._seen_dirpaths = set()
+        self._seen_filepaths = set()
+        self.hits = 0
+        self.misses = 0
+        return updates
+
+    def merge_updates(self, updates):
+        """merge_updates(updates)
+           Add the entries stored by another ScanCache (for instance in a
+           worker process), see pop_updates.
+        """
+        file_updates, dir_updates, seen_dirpaths, seen_filepaths, hits, misses = updates
+        self._updates.update(file_updates)
+        self._dir_updates.update(dir_updates)
+        self._seen_dirpaths.update(seen_dirpaths)
+        self._seen_filepaths.update(seen_filepaths)
+        self.hits += hits
+        self.misses += misses
+
+    def save(self, dirpath):
+        """save(dirpath)
+           Write the stored entries; the entries of files and directories
+           under 'dirpath' that have not been looked up are deleted.
+        """
+        updates = self._updates
+        dir_updates = self._dir_updates
+        seen_dirpaths = self._seen_dirpaths
+        seen_filepaths = self._seen_filepaths
+        self._updates = {}
+        self._dir_updates = {}
+        self._seen_dirpaths = set()
+        self._seen_filepaths = set()
+
+        dirpath_range = self._path_range(dirpath)
+        removed = [path for path in self._entries if dirpath_range[0] <= path < dirpath_range[1] and not path in seen_filepaths]
+        rows = []
+        for path, (stat_key, cache_entry) in updates.items():
+            filetypes = cache_entry.filetypes
+            if filetypes is not None:
+                filetypes = FILETYPES_SEPARATOR.join(sorted(filetypes))
+            rows.append((os.fsencode(path), ) + stat_key + (cache_entry.filetype, filetypes, cache_entry.qualifiers,
+                         cache_entry.lines, cache_entry.bytes, cache_entry.uncounted, int(cache_entry.pre_classified)))
+            self._entries[path] = (stat_key, cache_entry)
+        for path in removed:
+            del self._entries[path]
+
+        removed_dirs = [path for path in self._dir_entries if (path == dirpath or dirpath_range[0] <= path < dirpath_range[1]) and not path in seen_dirpaths]
+        dir_rows = []
+        for path, dir_entry in dir_updates.items():
+            stat_key, dirnames, filenames = dir_entry
+            dir_rows.append((os.fsencode(path), ) + stat_key + tuple(NAMES_SEPARATOR.join(os.fsencode(name) for name in names) for names in (dirnames, filenames)))
+            self._dir_entries[path] = dir_entry
+        for path in removed_dirs:
+            del self._dir_entries[path]
+
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("DELETE FROM files WHERE path = ?", ((os.fsencode(path), ) for path in removed))
+                connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                connection.executemany("DELETE FROM dirs WHERE path = ?", ((os.fsencode(path), ) for path in removed_dirs))
+                connection.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?, ?)", dir_rows)
+        finally:
+            connection.close()
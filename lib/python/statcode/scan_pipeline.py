@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import time
+import queue
+import threading
+
+from .file_reader import FileReader
+
+class PipelineStage(object):
+    """PipelineStage(name, function, workers, queue_size=0, next_stage=None)
+       A stage of a ScanPipeline: 'workers' threads take the items from
+       the stage queue (bounded if queue_size > 0) and call function(item),
+       which returns the items for 'next_stage', if any.
+       The stage counts the processed items, the time spent processing
+       them and the time spent waiting for a full next stage (both summed
+       over the workers), and the maximum queue depth.
+    """
+    def __init__(self, name, function, workers, queue_size=0, next_stage=None):
+        if workers < 1:
+            raise ValueError("invalid workers {!r} for stage {}; must be at least 1".format(workers, name))
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.next_stage = next_stage
+        self.items = 0
+        self.busy_time = 0.0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def put(self, item):
+        """put(item)
+           Add an item to the stage queue, waiting while it is full.
+        """
+        self.queue.put(item)
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def _run(self):
+        function = self.function
+        get = self.queue.get
+        while True:
+            item = get()
+            if item is None:
+                break
+            t0 = time.perf_counter()
+            next_items = function(item)
+            t1 = time.perf_counter()
+            if next_items:
+                put = self.next_stage.put
+                for next_item in next_items:
+                    put(next_item)
+            t2 = time.perf_counter()
+            with self._lock:
+                self.items += 1
+                self.busy_time += t1 - t0
+                self.blocked_time += t2 - t1
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name="statcode-{}-{}".format(self.name, i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for thread in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def throughput(self):
+        """throughput() -> items per second of worker time"""
+        if self.busy_time:
+            return self.items / self.busy_time
+        else:
+            return 0.0
+
+    def result(self):
+        return "{}: workers={}, items={}, busy={:.2f} s, blocked={:.2f} s, throughput={:.0f}/s, max_depth={}".format(
+            self.name, self.workers, self.items, self.busy_time, self.blocked_time, self.throughput(), self.max_depth)
+
+class _DirState(object):
+    # the files of a directory still in the pipeline
+    __slots__ = ('pre_classified', 'pending', 'done')
+    def __init__(self):
+        self.pre_classified = None
+        self.pending = 0
+        self.done = threading.Event()
+
+class _FileItem(object):
+    __slots__ = ('dir_state', 'index', 'project_file', 'file_reader', 'pre_classified')
+    def __init__(self, dir_state, index, project_file):
+        self.dir_state = dir_state
+        self.index = index
+        self.project_file = project_file
+        self.file_reader = None
+        self.pre_classified = False
+
+class ScanPipeline(object):
+    """ScanPipeline(project_tree, workers=(1, 1, 1, 1), queue_size=QUEUE_SIZE)
+       Classify a ProjectTree with a pipeline of stages connected by
+       queues, each with its own number of worker threads ('workers' is
+       the tuple of the number of workers of each stage):
+        * walk: list the directories;
+        * name: classify the files by name (and by shebang); files found
+          in the ScanCache skip the next stages;
+        * content: classify the files by content;
+        * count: count the lines (and store the files in the ScanCache).
+       The queues of the file stages are bounded, so that a fast stage
+       waits for the slower ones instead of piling up files in memory;
+       the files of a directory share the same FileReader across the
+       stages, so they are still opened at most once.
+       The final stage, the majority vote, runs in the calling thread, in
+       preorder, on each directory whose files have all been counted,
+       once the parent directories have been resolved; the directories
+       are fed to the walk stage in the same order, at most 'lookahead'
+       ahead of the majority vote, so that the listed directories do not
+       pile up waiting for it.
+    """
+    STAGE_NAMES = ('walk', 'name', 'content', 'count')
+    QUEUE_SIZE = 1024
+    LOOKAHEAD = 16
+    def __init__(self, project_tree, workers=(1, 1, 1, 1), queue_size=QUEUE_SIZE, lookahead=LOOKAHEAD):
+        if len(workers) != len(self.STAGE_NAMES):
+            raise ValueError("invalid workers {!r}; must be a number for each stage {}".format(workers, '|'.join(self.STAGE_NAMES)))
+        self.project_tree = project_tree
+        self.block_size = project_tree.project.block_size
+        self.io_limit = project_tree.project.io_limit
+        self.lookahead = lookahead
+        self._dir_states = {}
+        self._dir_states_lock = threading.Lock()
+        self._error = None
+        self._aborted = False
+        functions = (self._walk, self._classify_by_name, self._classify_by_content, self._count)
+        # the directories in the walk queue are bounded by the lookahead
+        queue_sizes = (0, queue_size, queue_size, queue_size)
+        self.stages = []
+        next_stage = None
+        for name, function, num_workers, stage_queue_size in reversed(list(zip(self.STAGE_NAMES, functions, workers, queue_sizes))):
+            next_stage = PipelineStage(name, function, num_workers, stage_queue_size, next_stage)
+            self.stages.insert(0, next_stage)
+        self._walk_stage = self.stages[0]
+
+    def _dir_state(self, project_dir):
+        with self._dir_states_lock:
+            dir_state = self._dir_states.get(project_dir, None)
+            if dir_state is None:
+                dir_state = self._dir_states[project_dir] = _DirState()
+            return dir_state
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+
+    def _file_done(self, file_item):
+        dir_state = file_item.dir_state
+        dir_state.pre_classified[file_item.index] = file_item.pre_classified
+        with self._dir_states_lock:
+            dir_state.pending -= 1
+            done = dir_state.pending == 0
+        if done:
+            dir_state.done.set()
+
+    def _walk(self, project_dir):
+        if self._aborted:
+            return
+        dir_state = self._dir_state(project_dir)
+        try:
+            project_dir.list_dir()
+        except Exception as e:
+            self._fail(e)
+            dir_state.done.set()
+            return
+        project_files = project_dir.project_files
+        dir_state.pre_classified = [False] * len(project_files)
+        if not project_files:
+            dir_state.done.set()
+            return
+        dir_state.pending = len(project_files)
+        return [_FileItem(dir_state, index, project_file) for index, project_file in enumerate(project_files)]
+
+    def _classify_by_name(self, file_item):
+        if self._aborted:
+            return
+        project_file = file_item.project_file
+        try:
+            pre_classified = project_file.lookup_cache()
+            if pre_classified is not None:
+                file_item.pre_classified = pre_classified
+                self._file_done(file_item)
+                return
+            file_item.file_reader = FileReader(project_file.filepath, self.block_size, self.io_limit)
+            project_file.pre_classify(file_item.file_reader)
+            file_item.pre_classified = project_file.filetype is not None
+        except Exception as e:
+            self._fail_file(file_item, e)
+        else:
+            return (file_item, )
+
+    def _classify_by_content(self, file_item):
+        if self._aborted:
+            file_item.file_reader.close()
+            return
+        try:
+            file_item.project_file.classify_by_content(file_item.file_reader)
+        except Exception as e:
+            self._fail_file(file_item, e)
+        else:
+            return (file_item, )
+
+    def _count(self, file_item):
+        if self._aborted:
+            file_item.file_reader.close()
+            return
+        project_file = file_item.project_file
+        try:
+            with file_item.file_reader:
+                project_file.make_file_stats(file_item.file_reader)
+            file_item.file_reader = None
+            project_file.store_cache(file_item.pre_classified)
+        except Exception as e:
+            self._fail_file(file_item, e)
+        else:
+            self._file_done(file_item)
+
+    def _fail_file(self, file_item, error):
+        self._fail(error)
+        if file_item.file_reader is not None:
+            file_item.file_reader.close()
+            file_item.file_reader = None
+        self._file_done(file_item)
+
+    def _start_listing(self, project_dir):
+        dir_state = self._dir_state(project_dir)
+        self._walk_stage.put(project_dir)
+        return dir_state
+
+    def run(self, detach=False):
+        """run(detach=False) -> iterator over the ProjectDirs
+           Run the pipeline; each ProjectDir is yielded, in preorder, once
+           its files have been completely classified; see ProjectDir.walk
+           for 'detach'.
+        """
+        for stage in self.stages:
+            stage.start()
+        completed = False
+        try:
+            walked_dir = None
+            for project_dir, dir_state in self.project_tree.walk_ahead(self._start_listing, self.lookahead):
+                # the previous directory has been walked, and can be detached
+                if detach and walked_dir is not None:
+                    walked_dir.project_dirs = []
+                walked_dir = project_dir
+                dir_state.done.wait()
+                if self._error is not None:
+                    raise self._error
+                with self._dir_states_lock:
+                    del self._dir_states[project_dir]
+                project_dir.resolve_classified_files(dir_state.pre_classified)
+                yield project_dir
+            completed = True
+        finally:
+            # on error, the pending items are discarded
+            self._aborted = not completed
+            for stage in self.stages:
+                stage.stop()
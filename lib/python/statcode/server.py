@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import io
+import json
+import stat
+import socket
+import tempfile
+import contextlib
+import socketserver
+
+from .project import Project, MetaProject, SortKey
+from .project_watcher import ProjectWatcher
+
+def default_socket_path():
+    """default_socket_path() -> the default path of the server socket"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR', None)
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'statcode.sock')
+    else:
+        return os.path.join(tempfile.gettempdir(), 'statcode-{}.sock'.format(os.getuid()))
+
+def check_socket(socket_path):
+    """check_socket(socket_path)
+       Check that 'socket_path' is a socket owned by the user, so that a
+       socket created by another user (for instance in a shared temporary
+       directory) is never used; ValueError is raised otherwise, OSError
+       if it does not exist.
+    """
+    stat_result = os.lstat(socket_path)
+    if not stat.S_ISSOCK(stat_result.st_mode):
+        raise ValueError("invalid socket {!r}: the path exists and is not a socket".format(socket_path))
+    if stat_result.st_uid != os.getuid():
+        raise ValueError("invalid socket {!r}: owned by uid {}, not by the user (uid {})".format(socket_path, stat_result.st_uid, os.getuid()))
+
+def send_request(socket_path, request):
+    """send_request(socket_path, request) -> response
+       Send a request (a dict, see StatCodeServer.handle_request) to the
+       server listening on 'socket_path', and return its response; the
+       socket must be owned by the user, see check_socket.
+    """
+    check_socket(socket_path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(request).encode('utf-8') + b'\n')
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise OSError("no response from server {!r}".format(socket_path))
+    return json.loads(line.decode('utf-8'))
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            response = self.server.handle_request(json.loads(line.decode('utf-8')))
+        except Exception as e:
+            response = {'error': "{}: {}".format(type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class StatCodeServer(socketserver.UnixStreamServer):
+    """StatCodeServer(socket_path, configuration, jobs=None)
+       A daemon that answers report requests over a Unix socket. The
+       configuration and the classifier are built once; each project is
+       scanned on its first request, and then kept up to date by a
+       ProjectWatcher, so that the next requests only apply the pending
+       changes. Without inotify, projects are scanned on each request.
+       Requests are served one at a time.
+    """
+    def __init__(self, socket_path, configuration, jobs=None):
+        self.configuration = configuration
+        self.jobs = jobs
+        self._projects = {}
+        self._watchers = {}
+        if os.path.lexists(socket_path):
+            # only a stale socket of the user is removed, never a file, a
+            # link or the socket of another user
+            check_socket(socket_path)
+            try:
+                send_request(socket_path, {'command': 'ping'})
+            except OSError:
+                # stale socket
+                os.unlink(socket_path)
+            else:
+                raise ValueError("invalid socket {!r}: a server is already running".format(socket_path))
+        # the socket is created accessible only by the user, instead of
+        # being chmod'ed after bind, so that others cannot connect meanwhile
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super().server_close()
+        for project_watcher in self._watchers.values():
+            project_watcher.close()
+        self._watchers.clear()
+        self._projects.clear()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+    def get_project(self, project_dir, filetype_hints=()):
+        """get_project(project_dir, filetype_hints=()) -> Project
+           Return the up to date Project for 'project_dir'.
+        """
+        key = (project_dir, tuple(filetype_hints))
+        project = self._projects.get(key, None)
+        if project is not None:
+            project_watcher = self._watchers[key]
+            project_watcher.update(project_watcher.inotify.read_events(timeout=0))
+            return project
+        project = Project(configuration=self.configuration, project_dir=project_dir, filetype_hints=list(filetype_hints),
+                          progress_bar_level=0, jobs=self.jobs)
+        try:
+            project_watcher = ProjectWatcher([project])
+        except OSError:
+            return project
+        self._projects[key] = project
+        self._watchers[key] = project_watcher
+        return project
+
+    def handle_request(self, request):
+        """handle_request(request) -> response
+           A request is a dict with keys 'command' ('report' or 'ping'),
+           'project_dirs', 'filetype_hints', 'sort_keys' (strings),
+           'select_filetypes', 'category_actions' ([action, pattern]
+           pairs) and 'list_files'; the response has the printed report
+           in 'output', or an 'error'.
+        """
+        command = request.get('command', 'report')
+        if command == 'ping':
+            return {'output': ''}
+        elif command != 'report':
+            raise ValueError("invalid command {!r}; valid values are ping|report".format(command))
+        meta_project = MetaProject(configuration=self.configuration)
+        for project_dir in request['project_dirs']:
+            if not os.path.isdir(project_dir):
+                raise ValueError("invalid project dir {!r}: not a directory".format(project_dir))
+            meta_project.add_project(self.get_project(os.path.normpath(os.path.abspath(project_dir)), request.get('filetype_hints') or ()))
+        sort_keys = [SortKey(sort_key) for sort_key in request.get('sort_keys', ())]
+        stream = io.StringIO()
+        with contextlib.redirect_stdout(stream):
+            if request.get('list_files'):
+                meta_project.list_filetype_files(request['list_files'], sort_keys=sort_keys)
+            else:
+                meta_project.report(sort_keys=sort_keys,
+                                    select_filetypes=request.get('select_filetypes', []),
+                                    category_actions=[tuple(category_action) for category_action in request.get('category_actions', ())])
+        return {'output': stream.getvalue()}
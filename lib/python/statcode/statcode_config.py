@@ -39,6 +39,10 @@ class StatCodeConfig(Config):
             'max_ratio': 1.0,
             'score_ratio': 0.1,
             'block_lines': 20,
+            'keyword_engine': 'regex',
+            'score_backend': 'python',
+            'stat_only_binary': False,
+            'stat_only_size': 0,
         }
     }
 
@@ -71,11 +75,13 @@ class StatCodeConfig(Config):
             abs_filenames.append(filename)
         return abs_filenames
 
+    def get_key_config_files(self, key):
+        return [self.absolute_filename(config_file) for config_file in self.string_to_list(self['config_files'][key])]
+
     def get_key_config(self, key):
         key_config_class = self.__key_class__[key]
         key_config = key_config_class()
-        for config_file in self.string_to_list(self['config_files'][key]):
-            config_file = self.absolute_filename(config_file)
+        for config_file in self.get_key_config_files(key):
             key_config.update(key_config_class(config_file))
         return key_config
             
@@ -18,24 +18,48 @@
 __author__ = 'Simone Campagna'
 
 class FileStats(object):
+    __slots__ = ('lines', 'bytes', 'uncounted')
     __fields__ = ('lines', 'bytes')
     files = 1
     dirs = 0
-    def __init__(self, lines=0, bytes=0):
+    def __init__(self, lines=0, bytes=0, uncounted=0):
         self.lines = lines
         self.bytes = bytes
+        # number of files whose lines have not been counted
+        self.uncounted = uncounted
 
     def __add__(self, stats):
-        return self.__class__(self.lines + stats.lines, self.bytes + stats.bytes)
+        return self.__class__(self.lines + stats.lines, self.bytes + stats.bytes, self.uncounted + stats.uncounted)
 
     def __iadd__(self, stats):
         self.lines += stats.lines
         self.bytes += stats.bytes
+        self.uncounted += stats.uncounted
+        return self
+
+    def __isub__(self, stats):
+        self.lines -= stats.lines
+        self.bytes -= stats.bytes
+        self.uncounted -= stats.uncounted
         return self
 
     def clear(self):
         self.lines = 0
         self.bytes = 0
+        self.uncounted = 0
+
+    def lines_str(self):
+        """lines_str() -> the number of lines, '-' if no line has been
+           counted, or the number of lines followed by '*' if some files
+           have not been counted.
+        """
+        if self.uncounted:
+            if self.uncounted >= self.files:
+                return '-'
+            else:
+                return '{}*'.format(self.lines)
+        else:
+            return str(self.lines)
 
     def tostr(self):
         return ', '.join("{}={!r}".format(field, getattr(self, field)) for field in self.__fields__)
@@ -50,18 +74,27 @@ class FileStats(object):
         return repr(self)
 
 class DirStats(FileStats):
+    __slots__ = ('files', )
     __fields__ = ('files', 'lines', 'bytes')
-    def __init__(self, files=0, lines=0, bytes=0):
+    def __init__(self, files=0, lines=0, bytes=0, uncounted=0):
         self.files = files
-        super().__init__(lines, bytes)
+        super().__init__(lines, bytes, uncounted)
 
     def __add__(self, stats):
-        return self.__class__(self.files + stats.files, self.lines + stats.lines, self.bytes + stats.bytes)
+        return self.__class__(self.files + stats.files, self.lines + stats.lines, self.bytes + stats.bytes, self.uncounted + stats.uncounted)
 
     def __iadd__(self, stats):
         self.files += stats.files
         self.lines += stats.lines
         self.bytes += stats.bytes
+        self.uncounted += stats.uncounted
+        return self
+
+    def __isub__(self, stats):
+        self.files -= stats.files
+        self.lines -= stats.lines
+        self.bytes -= stats.bytes
+        self.uncounted -= stats.uncounted
         return self
 
     def clear(self):
@@ -73,19 +106,29 @@ class DirStats(FileStats):
 #    __str__ = __repr__
 
 class TreeStats(DirStats):
+    __slots__ = ('dirs', )
     __fields__ = ('dirs', 'files', 'lines', 'bytes')
-    def __init__(self, dirs=0, files=0, lines=0, bytes=0):
+    def __init__(self, dirs=0, files=0, lines=0, bytes=0, uncounted=0):
         self.dirs  = dirs
-        super().__init__(files, lines, bytes)
+        super().__init__(files, lines, bytes, uncounted)
 
     def __add__(self, stats):
-        return self.__class__(self.dirs + stats.dirs, self.files + stats.files, self.lines + stats.lines, self.bytes + stats.bytes)
+        return self.__class__(self.dirs + stats.dirs, self.files + stats.files, self.lines + stats.lines, self.bytes + stats.bytes, self.uncounted + stats.uncounted)
 
     def __iadd__(self, stats):
         self.dirs  += stats.dirs
         self.files += stats.files
         self.lines += stats.lines
         self.bytes += stats.bytes
+        self.uncounted += stats.uncounted
+        return self
+
+    def __isub__(self, stats):
+        self.dirs  -= stats.dirs
+        self.files -= stats.files
+        self.lines -= stats.lines
+        self.bytes -= stats.bytes
+        self.uncounted -= stats.uncounted
         return self
 
     def clear(self):
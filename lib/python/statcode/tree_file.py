@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import gzip
+import json
+import collections
+
+from .file_table import FileTable
+from .project_tree import BaseTree
+from .stats import TreeStats
+
+# Tree files store the results of scans (see BaseTree), so that they can
+# be merged without scanning again, for instance when a scan is split
+# across several machines. A tree file is a sequence of trees; each tree
+# is a JSON header line, with the name, the number of projects, the
+# config key and the per-filetype TreeStats, optionally followed by the
+# FileTable columns as a JSON line, whose size is in the header: trees
+# can be loaded without their files, skipping them, in memory
+# proportional to the number of filetypes. Files whose name ends with
+# '.gz' are compressed.
+# VERSION must be increased when the format changes.
+
+FORMAT = 'statcode-tree'
+VERSION = 1
+
+TreeHeader = collections.namedtuple('TreeHeader', ('name', 'projects', 'config_key'))
+
+_FILE_TABLE_ARRAYS = ('dir_parent_ids', 'filetype_ids', 'qualifier_ids', 'dir_ids', 'lines', 'bytes', 'uncounted')
+
+def _open(filename, mode):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, mode)
+    else:
+        return open(filename, mode)
+
+def _stats_fields(stats):
+    return [stats.dirs, stats.files, stats.lines, stats.bytes, stats.uncounted]
+
+def _dump_line(obj):
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8') + b'\n'
+
+def _dump_file_table(file_table):
+    file_table.compact()
+    columns = {
+        'filetypes': file_table.filetypes,
+        'qualifiers': file_table.qualifiers,
+        'dir_names': file_table.dir_names,
+        'names': [file_table.filename(index) for index in range(len(file_table))],
+    }
+    for column in _FILE_TABLE_ARRAYS:
+        columns[column] = getattr(file_table, column).tolist()
+    # file names are encoded as by os.fsdecode, so that they are restored
+    return _dump_line(columns)
+
+def _load_file_table(line):
+    columns = json.loads(line.decode('utf-8'))
+    file_table = FileTable()
+    for filetype in columns['filetypes']:
+        file_table._filetype_id(filetype)
+    for qualifiers in columns['qualifiers'][1:]:
+        file_table._qualifier_id(qualifiers)
+    for parent_id, name in zip(columns['dir_parent_ids'], columns['dir_names']):
+        file_table._dir_id(parent_id, name)
+    for column in _FILE_TABLE_ARRAYS:
+        if column != 'dir_parent_ids':
+            getattr(file_table, column).extend(columns[column])
+    for name in columns['names']:
+        file_table.names += os.fsencode(name)
+        file_table.name_offsets.append(len(file_table.names))
+    return file_table
+
+def save_trees(filename, trees, config_key=None, files=False):
+    """save_trees(filename, trees, config_key=None, files=False)
+       Save the results of 'trees' (projects, see BaseProject) in the tree
+       file 'filename'; the per-file results are saved only if 'files' is
+       True.
+    """
+    with _open(filename, 'wb') as f_out:
+        for tree in trees:
+            if files:
+                file_table_line = _dump_file_table(tree.file_table)
+            else:
+                file_table_line = b''
+            header = {
+                'format': FORMAT,
+                'version': VERSION,
+                'name': tree.name,
+                'projects': tree.num_projects(),
+                'config_key': config_key,
+                'tree_stats': _stats_fields(tree.tree_stats),
+                'filetype_stats': [[filetype] + _stats_fields(stats) for filetype, stats in tree.tree_filetype_stats.items()],
+                'file_table_size': len(file_table_line),
+            }
+            f_out.write(_dump_line(header))
+            f_out.write(file_table_line)
+
+def _load_header(filename, line):
+    try:
+        header = json.loads(line.decode('utf-8'))
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get('format', None) != FORMAT:
+        raise ValueError("invalid tree file {!r}: not a {} file".format(filename, FORMAT))
+    version = header.get('version', None)
+    if version != VERSION:
+        raise ValueError("invalid tree file {!r}: unsupported version {!r}; supported version is {}".format(filename, version, VERSION))
+    try:
+        tree = BaseTree()
+        tree.tree_stats += TreeStats(*header['tree_stats'])
+        for filetype, *fields in header['filetype_stats']:
+            tree.tree_filetype_stats[filetype] += TreeStats(*fields)
+        tree_header = TreeHeader(name=header['name'], projects=header['projects'], config_key=header['config_key'])
+        file_table_size = header['file_table_size']
+        if not isinstance(file_table_size, int) or file_table_size < 0:
+            raise ValueError("file_table_size {!r}".format(file_table_size))
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError("invalid tree file {!r}: invalid header ({}: {})".format(filename, e.__class__.__name__, e))
+    return tree_header, tree, file_table_size
+
+def _read_file_table(filename, f_in, file_table_size):
+    data = f_in.read(file_table_size)
+    if len(data) != file_table_size:
+        raise ValueError("invalid tree file {!r}: truncated file table".format(filename))
+    return data
+
+def _skip_file_table(filename, f_in, file_table_size):
+    if isinstance(f_in, gzip.GzipFile):
+        # compressed files are read, in blocks, to find their size
+        while file_table_size > 0:
+            file_table_size -= len(_read_file_table(filename, f_in, min(file_table_size, 1024 * 1024)))
+    else:
+        # seeking past the end does not fail
+        offset = f_in.seek(file_table_size, os.SEEK_CUR)
+        if offset > os.fstat(f_in.fileno()).st_size:
+            raise ValueError("invalid tree file {!r}: truncated file table".format(filename))
+
+def load_trees(filename, files=False):
+    """load_trees(filename, files=False) -> iterator over (TreeHeader, BaseTree)
+       Load the trees saved by save_trees; the per-file results are loaded
+       only if 'files' is True (they must have been saved). ValueError is
+       raised for invalid or truncated files.
+    """
+    with _open(filename, 'rb') as f_in:
+        while True:
+            try:
+                line = f_in.readline()
+                if not line:
+                    break
+                tree_header, tree, file_table_size = _load_header(filename, line)
+                if files:
+                    if not file_table_size and tree.tree_stats.files:
+                        raise ValueError("invalid tree file {!r}: the files of {!r} have not been saved".format(filename, tree_header.name))
+                    if file_table_size:
+                        data = _read_file_table(filename, f_in, file_table_size)
+                        try:
+                            tree.file_table = _load_file_table(data)
+                        except (KeyError, TypeError, ValueError) as e:
+                            raise ValueError("invalid tree file {!r}: invalid file table ({}: {})".format(filename, e.__class__.__name__, e))
+                elif file_table_size:
+                    _skip_file_table(filename, f_in, file_table_size)
+            except EOFError:
+                # a truncated compressed file
+                raise ValueError("invalid tree file {!r}: truncated file".format(filename))
+            yield tree_header, tree
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Copyright 2013 Simone Campagna
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+__author__ = 'Simone Campagna'
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TOP_DIR, 'lib', 'python'))
+
+from statcode.statcode_config import StatCodeConfig
+from statcode.project_configuration import ProjectConfiguration
+
+class TestCompiledConfiguration(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='statcode-test-')
+        self.config_dir = os.path.join(self.tmpdir, 'etc')
+        shutil.copytree(os.path.join(TOP_DIR, 'etc', 'statcode'), self.config_dir)
+        self.config_file = os.path.join(self.config_dir, 'statcode.ini')
+        self.compiled_dir = os.path.join(self.tmpdir, 'compiled')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _project_configuration(self):
+        return ProjectConfiguration(StatCodeConfig.fromfiles(self.config_file), self.compiled_dir)
+
+    def _compiled_files(self):
+        return glob.glob(os.path.join(self.compiled_dir, 'classifier-*.pickle'))
+
+    def test_only_last_compiled_is_kept(self):
+        project_configuration = self._project_configuration()
+        self.assertEqual(len(self._compiled_files()), 1)
+        with open(self.config_file) as f_in:
+            content = f_in.read()
+        with open(self.config_file, 'w') as f_out:
+            f_out.write(content.replace('min_lines = 30', 'min_lines = 31'))
+        edited_project_configuration = self._project_configuration()
+        self.assertNotEqual(edited_project_configuration.compiled_key(), project_configuration.compiled_key())
+        compiled_files = self._compiled_files()
+        self.assertEqual(len(compiled_files), 1)
+        self.assertEqual(os.path.basename(compiled_files[0]), 'classifier-{}.pickle'.format(edited_project_configuration.compiled_key()))
+
+    def test_compiled_is_loaded(self):
+        project_configuration = self._project_configuration()
+        loaded_project_configuration = self._project_configuration()
+        self.assertEqual(loaded_project_configuration.exclude_dir_names, project_configuration.exclude_dir_names)
+        self.assertEqual(len(self._compiled_files()), 1)
+
+if __name__ == "__main__":
+    unittest.main()